@@ -0,0 +1,148 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from rewriter import LiteralRewriter
+from urllib.parse import urlsplit, urlunsplit
+import hashlib
+import http.client
+import json
+import mimetypes
+import os
+import tempfile
+import threading
+import urllib.request
+
+_CHUNK_SIZE = 64 * 1024
+
+
+class AttachmentMirror:
+    """
+    Copies the images and attachments the issues refer to into a local content-addressed store
+    and points the issue descriptions and comments at their copies below base_url,
+    wherever the store gets published, so they outlive the JIRA server.
+    Every URL is fetched once, files with the same content are stored once under the hash of
+    their content. A manifest in the store maps the URLs fetched so far to their files,
+    reruns only fetch what is new. Failed downloads keep pointing to JIRA.
+    """
+    _DEFAULT_MAX_WORKERS = 8
+    _DEFAULT_TIME_OUT = 60.0
+    _MANIFEST = 'manifest.json'
+
+    def __init__(self, directory, base_url, max_workers=_DEFAULT_MAX_WORKERS, source_url=None,
+                 headers={}, timeout=_DEFAULT_TIME_OUT, metrics=None):
+        self.directory = directory
+        self.base_url = base_url.rstrip('/')
+        self.max_workers = max(1, max_workers)
+        self.source_url = source_url
+        self.headers = headers
+        self.timeout = timeout
+        self.metrics = metrics
+        self._lock = threading.Lock()
+
+    def mirror(self, project):
+        """
+        Fetches the attachments of the project that are not in the store yet and rewrites the bodies.
+        Returns the number of attachments the bodies now point to the store for.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        urls = project.get_attachments()
+        manifest = self._read_manifest()
+        missing = [url for url in urls if url not in manifest]
+        print('Mirroring %d attachments, %d of them are in the store already' % (len(urls), len(urls) - len(missing)))
+
+        failures = []
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = dict((executor.submit(self._fetch, url), url) for url in missing)
+                for future in as_completed(futures):
+                    url = futures[future]
+                    try:
+                        manifest[url] = future.result()
+                        self._count('attachments_fetched')
+                    except (OSError, ValueError, http.client.HTTPException) as e:
+                        failures.append(url + ': ' + str(e))
+                        self._count('attachments_failed')
+        finally:
+            # what was fetched is kept even if the mirroring was interrupted
+            self._write_manifest(manifest)
+
+        if failures:
+            print('Warning: %d attachments could not be fetched, they still point to JIRA:' % len(failures))
+            for failure in sorted(failures):
+                print('  ' + failure)
+
+        # whole href values are replaced, a mirrored URL can be the prefix of one that failed
+        mirrored = dict(('href="' + url + '"', 'href="' + self.base_url + '/' + manifest[url] + '"')
+                        for url in urls if url in manifest)
+        rewriter = LiteralRewriter(mirrored)
+        for issue in project.get_issues():
+            issue.body = rewriter.sub(issue.body)
+            for comment in issue.comments:
+                comment.body = rewriter.sub(comment.body)
+        return len(mirrored)
+
+    def _fetch(self, url):
+        """
+        Downloads an attachment into the store and returns its path there, relative to the store.
+        """
+        request = urllib.request.Request(self._source(url), headers=self.headers)
+        digest = hashlib.sha256()
+        descriptor, temporary = tempfile.mkstemp(dir=self.directory, suffix='.part')
+        try:
+            with os.fdopen(descriptor, 'wb') as out, urllib.request.urlopen(request, timeout=self.timeout) as response:
+                content_type = response.headers.get_content_type()
+                while True:
+                    chunk = response.read(_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    out.write(chunk)
+            content_hash = digest.hexdigest()
+            folder = os.path.join(self.directory, content_hash[:2])
+            with self._lock:
+                os.makedirs(folder, exist_ok=True)
+                stored = [name for name in os.listdir(folder) if name.startswith(content_hash)]
+                if stored:
+                    # the same file under another URL
+                    os.remove(temporary)
+                    self._count('attachments_deduplicated')
+                    name = stored[0]
+                else:
+                    name = content_hash + self._extension(url, content_type)
+                    os.replace(temporary, os.path.join(folder, name))
+            return content_hash[:2] + '/' + name
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+
+    def _source(self, url):
+        """
+        Returns where to fetch an attachment from, on source_url instead of the exported JIRA server if given.
+        """
+        if not self.source_url:
+            return url
+        parts = urlsplit(url)
+        source = urlsplit(self.source_url)
+        return urlunsplit((source.scheme, source.netloc, source.path.rstrip('/') + parts.path, parts.query, ''))
+
+    def _extension(self, url, content_type):
+        extension = os.path.splitext(urlsplit(url).path)[1].lower()
+        if extension and len(extension) <= 8:
+            return extension
+        return mimetypes.guess_extension(content_type) or ''
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.directory, AttachmentMirror._MANIFEST), encoding='utf-8') as source:
+                return json.load(source)
+        except FileNotFoundError:
+            return dict()
+
+    def _write_manifest(self, manifest):
+        path = os.path.join(self.directory, AttachmentMirror._MANIFEST)
+        with open(path + '.tmp', 'w', encoding='utf-8') as out:
+            json.dump(manifest, out, indent=1, sort_keys=True)
+        os.replace(path + '.tmp', path)
+
+    def _count(self, name):
+        if self.metrics:
+            self.metrics.count(name)
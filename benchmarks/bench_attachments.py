@@ -0,0 +1,116 @@
+"""
+Times the attachment mirroring against the fake JIRA server and checks what it promises:
+every URL is fetched once, files with the same content are stored once, the bodies point
+to the store except for the attachments that failed, which keep their JIRA URL unchanged,
+images on other hosts are neither fetched nor rewritten, and a rerun only fetches what failed before.
+
+    python benchmarks/bench_attachments.py --issues 1000 --distinct 50 --latency 0.02
+"""
+from xml.sax.saxutils import escape
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS))
+sys.path.insert(0, BENCHMARKS)
+
+from attachments import AttachmentMirror  # noqa: E402
+from fake_jira import FakeJira  # noqa: E402
+from generate_export import ExportGenerator  # noqa: E402
+from metrics import Metrics  # noqa: E402
+from xmlreader import parse_files  # noqa: E402
+
+MIRROR_URL = 'https://mirror.example/attachments'
+EXTERNAL_IMAGE = 'https://images.example/logo.png'
+# the fake server has no attachment at the second URL, the first one is its prefix,
+# the image on another host must be neither fetched nor rewritten
+INJECTED_LINKS = ('<a href="/secure/attachment/1/notes.txt">notes</a> '
+                  '<a href="/secure/attachment/1/notes.txt/old">old notes</a> '
+                  '<img src="' + EXTERNAL_IMAGE + '" alt="logo"/> ')
+
+
+def generate(file_name, issues, attachments):
+    ExportGenerator(images=0.3, attachments=attachments).write(file_name, issues)
+    with open(file_name, encoding='utf-8') as source:
+        text = source.read()
+    comment = text.index('<comment ')
+    start = text.index(escape('<p>'), comment) + len(escape('<p>'))
+    with open(file_name, 'w', encoding='utf-8') as out:
+        out.write(text[:start] + escape(INJECTED_LINKS) + text[start:])
+
+
+def quietly(function, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
+
+
+def bodies(project):
+    return [issue.body for issue in project.get_issues()] + \
+        [comment.body for issue in project.get_issues() for comment in issue.comments]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks and checks the attachment mirroring offline.')
+    parser.add_argument('--issues', type=int, default=1000)
+    parser.add_argument('--attachments', type=int, default=400, help='number of distinct attachment ids')
+    parser.add_argument('--distinct', type=int, default=50, help='number of distinct attachment contents')
+    parser.add_argument('--latency', type=float, default=0.02, help='fake JIRA latency per download')
+    parser.add_argument('--workers', type=int, default=AttachmentMirror._DEFAULT_MAX_WORKERS)
+    args = parser.parse_args()
+
+    failures = []
+
+    def check(description, passed):
+        print('%-60s %s' % (description, 'ok' if passed else 'FAILED'))
+        if not passed:
+            failures.append(description)
+
+    with tempfile.TemporaryDirectory() as directory, FakeJira(args.latency, args.distinct) as jira:
+        file_name = os.path.join(directory, 'export.xml')
+        generate(file_name, args.issues, args.attachments)
+        store = os.path.join(directory, 'store')
+        project = quietly(parse_files, [file_name])
+        urls = project.get_attachments()
+        failed = [url for url in urls if url.endswith('/notes.txt/old')]
+
+        metrics = Metrics()
+        mirror = AttachmentMirror(store, MIRROR_URL, args.workers, jira.url, metrics=metrics)
+        started = time.perf_counter()
+        mirrored = quietly(mirror.mirror, project)
+        elapsed = time.perf_counter() - started
+        counters = metrics.counters
+        print('%d attachments, %d mirrored in %.2f s, %.0f attachments/s with %d workers' % (
+            len(urls), mirrored, elapsed, len(urls) / elapsed, args.workers))
+
+        check('every URL is fetched once',
+              len(jira.requests) == len(urls) and max(jira.requests.values()) == 1)
+        ids = set(int(path.split('/')[3]) for path in jira.requests if not path.endswith('/old'))
+        contents = set(jira.content(attachment_id) for attachment_id in ids)
+        stored = [name for folder, _, names in os.walk(store) for name in names if name != 'manifest.json']
+        check('files with the same content are stored once', len(stored) == len(contents))
+        check('deduplicated and fetched files add up',
+              counters['attachments_fetched'] - counters['attachments_deduplicated'] == len(contents))
+        check('only the missing attachment failed',
+              failed and counters['attachments_failed'] == len(failed) and mirrored == len(urls) - len(failed))
+        text = '\n'.join(bodies(project))
+        check('the bodies point to the store', text.count(MIRROR_URL) >= mirrored)
+        check('a failed URL keeps pointing to JIRA unchanged', all('href="%s"' % url in text for url in failed))
+        check('images on other hosts are left alone',
+              EXTERNAL_IMAGE not in urls and 'href="%s"' % EXTERNAL_IMAGE in text)
+
+        before = sum(jira.requests.values())
+        rerun = quietly(parse_files, [file_name])
+        quietly(AttachmentMirror(store, MIRROR_URL, args.workers, jira.url).mirror, rerun)
+        check('a rerun only fetches the failed attachments', sum(jira.requests.values()) - before == len(failed))
+        check('a rerun rewrites the bodies the same way', bodies(rerun) == bodies(project))
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
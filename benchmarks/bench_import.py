@@ -0,0 +1,130 @@
+"""
+Offline benchmarks of the whole import: parse throughput, transform cost per issue,
+peak memory while parsing and the end-to-end import rate against the fake GitHub server.
+
+    python benchmarks/bench_import.py --issues 2000 --files 4
+"""
+from collections import namedtuple
+import argparse
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS))
+sys.path.insert(0, BENCHMARKS)
+
+from fake_github import FakeGitHub  # noqa: E402
+from generate_export import ExportGenerator  # noqa: E402
+from importer import Importer  # noqa: E402
+from labelcolourselector import LabelColourSelector  # noqa: E402
+from transport import HttpTransport  # noqa: E402
+from xmlreader import parse_files  # noqa: E402
+
+Options = namedtuple("Options", "account repo")
+
+
+def generate(directory, issues, files, comments):
+    generator = ExportGenerator(comments=comments)
+    per_file = -(-issues // files)
+    file_names = []
+    for index in range(files):
+        start = 1 + index * per_file
+        count = min(per_file, issues - start + 1)
+        if count <= 0:
+            break
+        file_name = os.path.join(directory, 'export-%d.xml' % index)
+        generator.write(file_name, count, start)
+        file_names.append(file_name)
+    return file_names
+
+
+def quietly(function, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
+
+
+def bench_parse(file_names, workers):
+    started = time.perf_counter()
+    project = quietly(parse_files, file_names, ['imported'], workers)
+    return project, time.perf_counter() - started
+
+
+def bench_transform(project):
+    importer = Importer(Options('owner', 'repo'), project)
+    for number, mkey in enumerate(project.get_milestones().keys(), 1):
+        importer.milestone_ids[mkey] = number
+    started = time.perf_counter()
+    for issue in project.get_issues():
+        importer.build_issue_payload(issue)
+    return time.perf_counter() - started
+
+
+def peak_parse_memory(file_names):
+    """
+    Parses in a fresh interpreter and returns its peak resident set size in MB.
+    """
+    code = ('import sys, resource; sys.path.insert(0, %r); from xmlreader import parse_files; '
+            'parse_files(sys.argv[1:], workers=1); '
+            'print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)' % os.path.dirname(BENCHMARKS))
+    result = subprocess.run([sys.executable, '-c', code] + file_names, capture_output=True, text=True, check=True)
+    peak = int(result.stdout.strip().splitlines()[-1])
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def bench_end_to_end(file_names, latency, import_delay, in_flight):
+    with FakeGitHub(latency=latency, import_delay=import_delay) as github:
+        project = quietly(parse_files, file_names, ['imported'])
+        importer = Importer(Options('owner', 'repo'), project, HttpTransport('fake', github.url), in_flight)
+        started = time.perf_counter()
+        quietly(importer.import_milestones)
+        quietly(importer.import_labels, LabelColourSelector(project))
+        quietly(importer.import_issues)
+        quietly(importer.post_process_comments)
+        elapsed = time.perf_counter() - started
+        return len(project.get_issues()), elapsed, sum(github.calls.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the JIRA importer offline.')
+    parser.add_argument('--issues', type=int, default=2000)
+    parser.add_argument('--files', type=int, default=4)
+    parser.add_argument('--comments', type=float, default=3.0, help='average comments per issue')
+    parser.add_argument('--import-issues', type=int, default=200,
+                        help='issues used for the end-to-end import, which is slower')
+    parser.add_argument('--latency', type=float, default=0.01, help='fake GitHub latency per request')
+    parser.add_argument('--import-delay', type=float, default=0.01, help='fake GitHub time per import')
+    parser.add_argument('--in-flight', type=int, default=Importer._DEFAULT_MAX_IN_FLIGHT)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        file_names = generate(directory, args.issues, args.files, args.comments)
+        size = sum(os.path.getsize(file_name) for file_name in file_names) / 1e6
+        print('%d issues in %d files, %.1f MB' % (args.issues, len(file_names), size))
+
+        project, serial = bench_parse(file_names, 1)
+        _, parallel = bench_parse(file_names, None)
+        print('parse, 1 worker:        %8.0f issues/s %8.1f MB/s' % (args.issues / serial, size / serial))
+        print('parse, %2d workers:      %8.0f issues/s %8.1f MB/s' % (
+            min(os.cpu_count() or 1, len(file_names)), args.issues / parallel, size / parallel))
+
+        transform = bench_transform(project)
+        print('transform:              %8.1f us/issue' % (1e6 * transform / args.issues))
+
+        print('peak RSS while parsing: %8.1f MB' % peak_parse_memory(file_names))
+
+        import_directory = os.path.join(directory, 'import')
+        os.mkdir(import_directory)
+        import_files = generate(import_directory, args.import_issues, 1, args.comments)
+        issues, elapsed, calls = bench_end_to_end(import_files, args.latency, args.import_delay, args.in_flight)
+        print('end-to-end import:      %8.1f issues/s (%d issues, %d API calls, %.1f s)' % (
+            issues / elapsed, issues, calls, elapsed))
+
+
+if __name__ == '__main__':
+    main()
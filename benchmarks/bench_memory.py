@@ -0,0 +1,85 @@
+"""
+Compares the memory used by the slotted Issue/Comment/Link records with the
+dict-of-lists layout the project used to keep for every issue.
+
+    python benchmarks/bench_memory.py [issue count]
+"""
+import gc
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from records import Comment, Issue, Link  # noqa: E402
+
+LABELS = ['bug', 'task', 'story', 'backend', 'frontend', 'imported']
+
+
+def issue_fields(index, rng):
+    return {'key': 'PRO-%d' % index,
+            'title': 'Issue title %d' % index,
+            'body': 'Description of issue %d' % index,
+            'created_at': '2020-03-03T10:12:01+00:00',
+            'updated_at': '2020-03-04T11:00:00+01:00',
+            'closed_at': '2020-03-05T11:00:00+01:00' if rng.random() < 0.5 else None,
+            'labels': [''.join(label) for label in rng.sample(LABELS, 2)],
+            'comments': [('Comment %d' % c, '2020-03-03T12:00:00+00:00') for c in range(rng.randrange(4))],
+            'links': [(rng.choice(Link.KINDS), 'PRO-%d' % rng.randrange(index + 1))
+                      for _ in range(1 if rng.random() < 0.2 else 0)]}
+
+
+def dict_layout(fields):
+    issue = {'title': fields['title'], 'key': fields['key'], 'body': fields['body'],
+             'created_at': fields['created_at'], 'updated_at': fields['updated_at'],
+             'labels': list(fields['labels']),
+             'comments': [{'created_at': created_at, 'body': body} for body, created_at in fields['comments']],
+             'duplicates': [], 'is-duplicated-by': [], 'is-related-to': [], 'depends-on': [], 'blocks': []}
+    for kind, key in fields['links']:
+        issue[kind].append(key)
+    if fields['closed_at']:
+        issue['closed_at'] = fields['closed_at']
+        issue['closed'] = True
+    else:
+        issue['closed'] = False
+    return issue
+
+
+def record_layout(fields):
+    issue = Issue(fields['key'], fields['title'], fields['body'],
+                  fields['created_at'], fields['updated_at'], fields['closed_at'])
+    for label in fields['labels']:
+        issue.add_label(label)
+    for body, created_at in fields['comments']:
+        issue.comments.append(Comment(body, created_at))
+    for kind, key in fields['links']:
+        issue.add_link(kind, key)
+    return issue
+
+
+def measure(build, all_fields):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    issues = [build(fields) for fields in all_fields]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del issues
+    return used
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rng = random.Random(42)
+    all_fields = [issue_fields(index, rng) for index in range(1, count + 1)]
+    # strings shared by both layouts are created up front and not counted
+    dicts = measure(dict_layout, all_fields)
+    records = measure(record_layout, all_fields)
+    print('%d issues' % count)
+    print('  dict layout:   %8.1f MB (%d bytes per issue)' % (dicts / 1e6, dicts // count))
+    print('  record layout: %8.1f MB (%d bytes per issue)' % (records / 1e6, records // count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Micro-benchmarks for the issue reference and user id rewriting done by the Importer.
+Compares the rewriters with the previous one-re.sub-per-pattern and one-str.replace-per-user
+implementations and shows how both scale with text size and number of users. References
+are rewritten with placeholder templates, or in a single pass with a callback per match
+when they are resolved on upload, which is timed with no issue imported yet.
+
+    python benchmarks/bench_rewriter.py
+"""
+from collections import namedtuple
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from importer import Importer  # noqa: E402
+from project import Project  # noqa: E402
+
+Options = namedtuple("Options", "account repo")
+
+
+def account_id(rng):
+    return '5%s:%s' % (rng.randrange(10 ** 5), ''.join(rng.choice('0123456789abcdef') for _ in range(32)))
+
+
+def make_project(user_count, rng):
+    project = Project()
+    project.name = 'PRO'
+    for _ in range(user_count):
+        project.users[account_id(rng)] = 'User %d' % rng.randrange(10 ** 6)
+    return project
+
+
+def make_text(size, users, rng):
+    words = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit'] * 4 + \
+        ['PRO-%d', 'Issue %d', 'https://java.net/jira/browse/PRO-%d']
+    parts = []
+    length = 0
+    while length < size:
+        word = rng.choice(words)
+        if '%d' in word:
+            word = word % rng.randrange(1, 20000)
+        elif rng.random() < 0.05:
+            word = '[~accountid:%s]' % rng.choice(users)
+        parts.append(word)
+        length += len(word) + 1
+    return ' '.join(parts)
+
+
+def old_replace_jira_with_github_id(importer, text):
+    result = text
+    for pattern, replacement in importer.jira_issue_replace_patterns.items():
+        result = re.sub(pattern, Importer._PLACEHOLDER_PREFIX +
+                        replacement + Importer._PLACEHOLDER_SUFFIX, result)
+    return result
+
+
+def old_replace_user_ids(importer, text):
+    result = text
+    for userid in importer.project.users:
+        result = result.replace(userid, importer.project.users[userid])
+    return result
+
+
+def measure(function, repeat=3):
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def main():
+    rng = random.Random(42)
+    print('%8s %10s %14s %14s %14s %14s %14s' % ('users', 'text KB', 'old refs ms', 'new refs ms',
+                                                 'resolve refs ms', 'old users ms', 'new users ms'))
+    for user_count in (100, 1000, 5000):
+        project = make_project(user_count, rng)
+        importer = Importer(Options('account', 'repo'), project)
+        resolving = Importer(Options('account', 'repo'), project, resolve_references=True)
+        users = list(project.users)
+        for size in (10000, 100000, 1000000):
+            text = make_text(size, users, rng)
+            assert importer._replace_jira_with_github_id(text) == old_replace_jira_with_github_id(importer, text)
+            assert resolving._replace_jira_with_github_id(text) == old_replace_jira_with_github_id(importer, text)
+            assert importer._replace_user_ids(text) == old_replace_user_ids(importer, text)
+            print('%8d %10d %14.2f %14.2f %14.2f %14.2f %14.2f' % (
+                user_count, size // 1000,
+                1000 * measure(lambda: old_replace_jira_with_github_id(importer, text)),
+                1000 * measure(lambda: importer._replace_jira_with_github_id(text)),
+                1000 * measure(lambda: resolving._replace_jira_with_github_id(text)),
+                1000 * measure(lambda: old_replace_user_ids(importer, text)),
+                1000 * measure(lambda: importer._replace_user_ids(text))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Checks the JIRA timestamp fast path against dateutil on a generated corpus
+and compares their speed.
+
+    python benchmarks/bench_timestamps.py [corpus size]
+"""
+from datetime import datetime, timedelta
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dateutil.parser import parse  # noqa: E402
+from timestamps import to_iso  # noqa: E402
+
+OFFSETS = ['+0000', '-0000', '+0100', '+0200', '+0530', '+0545', '-0500', '-0800', '-0330', '+1400', '-1200']
+# forms the fast path does not handle, they have to come out the same through the fallback
+OTHER_FORMS = ['2020-03-03T10:12:01+00:00', '3 March 2020 10:12', 'Tue, 3 Mar 2020 10:12:01 GMT',
+               'Tue, 3 Mar 2020 10:12:01', 'Mon, 29 Feb 2021 10:12:01 +0000', 'Tue, 3 Mar 2020 10:12:01 +2500']
+
+
+def corpus(size, rng):
+    start = datetime(1999, 1, 1)
+    timestamps = []
+    for _ in range(size):
+        moment = start + timedelta(seconds=rng.randrange(30 * 365 * 24 * 3600))
+        day = str(moment.day) if rng.random() < 0.7 else '%02d' % moment.day
+        weekday = moment.strftime('%a, ') if rng.random() < 0.95 else ''
+        timestamps.append(weekday + day + moment.strftime(' %b %Y %H:%M:%S ') + rng.choice(OFFSETS))
+    return timestamps + OTHER_FORMS
+
+
+def dateutil_iso(timestamp):
+    try:
+        return parse(timestamp).isoformat()
+    except (ValueError, OverflowError) as e:
+        return type(e)
+
+
+def fast_iso(timestamp):
+    try:
+        return to_iso(timestamp)
+    except (ValueError, OverflowError) as e:
+        return type(e)
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    timestamps = corpus(size, random.Random(42))
+    mismatches = [(t, dateutil_iso(t), fast_iso(t)) for t in timestamps if dateutil_iso(t) != fast_iso(t)]
+    for mismatch in mismatches:
+        print('MISMATCH %r: dateutil %r, fast path %r' % mismatch)
+    print('%d timestamps checked, %d mismatches' % (len(timestamps), len(mismatches)))
+
+    jira_timestamps = timestamps[:size]
+    slow = min(timeit.repeat(lambda: [parse(t).isoformat() for t in jira_timestamps], number=1, repeat=3))
+    fast = min(timeit.repeat(lambda: [to_iso(t) for t in jira_timestamps], number=1, repeat=3))
+    print('dateutil:  %8.2f us per timestamp' % (1e6 * slow / size))
+    print('fast path: %8.2f us per timestamp' % (1e6 * fast / size))
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
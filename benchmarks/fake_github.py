@@ -0,0 +1,385 @@
+"""
+A local stand-in for the GitHub REST endpoints used by the Importer and the GraphQL
+operations of its batching, for benchmarks and offline experiments. Latency, transient
+server errors, a primary rate limit, failed imports and import uploads that are queued
+but answered with an error can be injected.
+
+    python benchmarks/fake_github.py --port 8000 --latency 0.05
+
+then point the importer at it with `main.py --api-url http://127.0.0.1:8000 ...`
+(the http transport needs some token, e.g. GH_TOKEN=fake).
+"""
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+import argparse
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+
+
+def _now():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class FakeGitHub:
+    """
+    Serves one repository per owner/repo path, all state is kept in memory.
+    Issue imports are processed in submission order by a background worker,
+    import_delay seconds each, like GitHub's import queue.
+    """
+
+    def __init__(self, latency=0.0, failure_rate=0.0, import_delay=0.05, import_failure_rate=0.0,
+                 seed=42, port=0, rate_limit=None, rate_limit_window=60.0, lost_response_rate=0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.import_delay = import_delay
+        self.import_failure_rate = import_failure_rate
+        self.rate_limit = rate_limit
+        self.rate_limit_window = rate_limit_window
+        self.lost_response_rate = lost_response_rate
+        self.rate_limited = 0
+        self.not_modified = 0
+        # by rate limit resource, core or graphql
+        self._window_started = dict()
+        self._window_used = Counter()
+        self.calls = Counter()
+        self.imports = dict()
+        self.issues = dict()
+        self.comments = dict()
+        self.labels = dict()
+        self.milestones = dict()
+        self.graphql_operations = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._queue = []
+        self._queued = threading.Condition(self._lock)
+        self._import_ids = itertools.count(1)
+        self._comment_ids = itertools.count(1000)
+        self._next_issue = 1
+        self._stopped = False
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), _handler(self))
+        self._server.daemon_threads = True
+        self._threads = [threading.Thread(target=self._server.serve_forever, daemon=True),
+                         threading.Thread(target=self._process_imports, daemon=True)]
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self._server.server_port
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            self._queued.notify_all()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def handle(self, method, path, query, body, if_none_match=None, accept=None):
+        """
+        Returns status, headers and JSON data of the response to a request.
+        GET responses carry an ETag, a matching If-None-Match is answered with 304 Not Modified
+        without counting against the rate limit, like GitHub does.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        m = re.fullmatch(r'/repos/([^/]+)/([^/]+)(/.*)', path)
+        if not m and path != '/graphql':
+            return 404, {}, {'message': 'Not Found'}
+        route = m[3] if m else path
+        limit_headers = self._rate_limit_headers('graphql' if route == '/graphql' else 'core')
+        if limit_headers.get('X-RateLimit-Remaining') == '-1':
+            self.rate_limited += 1
+            limit_headers['X-RateLimit-Remaining'] = '0'
+            return 403, limit_headers, {'message': 'API rate limit exceeded'}
+        self.calls[(method, re.sub(r'/\d+$', '/{id}', route))] += 1
+        if self.failure_rate and self._random() < self.failure_rate:
+            return 502, limit_headers, {'message': 'Server Error'}
+        if route == '/graphql':
+            status, headers, data = self._graphql(body, accept or '')
+        else:
+            status, headers, data = self._route(method, path, route, query, body)
+            if route == '/import/issues' and status == 202 and self.lost_response_rate and \
+                    self._random() < self.lost_response_rate:
+                # queued all the same
+                return 502, limit_headers, {'message': 'Server Error'}
+        if method == 'GET' and status == 200:
+            headers['ETag'] = '"%s"' % hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()
+            if if_none_match == headers['ETag']:
+                status, data = 304, None
+                with self._lock:
+                    self.not_modified += 1
+                    if limit_headers:
+                        self._window_used['core'] -= 1
+                        limit_headers['X-RateLimit-Remaining'] = str(int(limit_headers['X-RateLimit-Remaining']) + 1)
+        headers.update(limit_headers)
+        return status, headers, data
+
+    def _route(self, method, path, route, query, body):
+        with self._lock:
+            if route == '/import/issues':
+                if method == 'POST':
+                    return self._create_import(body)
+                since = query.get('since', [''])[0]
+                return 200, {}, [self._import_status(i) for i in self.imports.values() if i['created_at'] >= since]
+            m = re.fullmatch(r'/import/issues/(\d+)', route)
+            if m and int(m[1]) in self.imports:
+                return 200, {}, self._import_status(self.imports[int(m[1])])
+            if route == '/labels':
+                if method == 'POST':
+                    return self._create(self.labels, body['name'].lower(), body)
+                return self._page(path, query, list(self.labels.values()))
+            m = re.fullmatch(r'/labels/(.+)', route)
+            if m:
+                label = self.labels.get(unquote(m[1]).lower())
+                return (200, {}, label) if label else (404, {}, {'message': 'Not Found'})
+            if route == '/milestones':
+                if method == 'POST':
+                    milestone = {'title': body['title'], 'number': len(self.milestones) + 1}
+                    return self._create(self.milestones, body['title'], milestone)
+                return self._page(path, query, list(self.milestones.values()))
+            if route == '/issues/comments':
+                since = query.get('since', [''])[0]
+                comments = sorted((c for c in self.comments.values() if c['updated_at'] >= since),
+                                  key=lambda c: (c['updated_at'], c['id']))
+                return self._page(path, query, comments)
+            m = re.fullmatch(r'/issues/comments/(\d+)', route)
+            if m and int(m[1]) in self.comments and method == 'PATCH':
+                comment = self.comments[int(m[1])]
+                comment['body'] = body['body']
+                comment['updated_at'] = _now()
+                return 200, {}, comment
+            m = re.fullmatch(r'/issues/(\d+)(/comments)?', route)
+            if m and int(m[1]) in self.issues:
+                return self._issue(method, path, query, int(m[1]), bool(m[2]), body)
+        return 404, {}, {'message': 'Not Found'}
+
+    def _rate_limit_headers(self, resource):
+        """
+        Counts the request against the rate limit window of its resource like GitHub does,
+        REST and GraphQL have separate budgets. A remaining count of -1 marks a request over the limit.
+        """
+        if not self.rate_limit:
+            return {}
+        with self._lock:
+            now = time.time()
+            if now >= self._window_started.get(resource, 0.0) + self.rate_limit_window:
+                self._window_started[resource] = now
+                self._window_used[resource] = 0
+            self._window_used[resource] += 1
+            return {'X-RateLimit-Limit': str(self.rate_limit),
+                    'X-RateLimit-Remaining': str(max(self.rate_limit - self._window_used[resource], -1)),
+                    'X-RateLimit-Reset': str(int(self._window_started[resource] + self.rate_limit_window) + 1),
+                    'X-RateLimit-Resource': resource}
+
+    def _random(self):
+        with self._lock:
+            return self._rng.random()
+
+    def _create(self, collection, key, item):
+        if key in collection:
+            return 422, {}, {'message': 'Validation Failed'}
+        collection[key] = item
+        return 201, {}, item
+
+    def _page(self, path, query, items):
+        per_page = min(int(query.get('per_page', ['30'])[0]), 100)
+        page = int(query.get('page', ['1'])[0])
+        headers = {}
+        if page * per_page < len(items):
+            params = dict((k, v[0]) for k, v in query.items())
+            params['page'] = str(page + 1)
+            headers['Link'] = '<%s%s?%s>; rel="next"' % (
+                self.url, path, '&'.join('%s=%s' % item for item in params.items()))
+        return 200, headers, items[(page - 1) * per_page:page * per_page]
+
+    def _issue(self, method, path, query, number, comments, body):
+        if comments:
+            if method == 'POST':
+                comment_id = next(self._comment_ids)
+                comment = {'id': comment_id, 'node_id': 'IC_%d' % comment_id, 'body': body['body'],
+                           'issue_number': number,
+                           'created_at': _now(), 'updated_at': _now()}
+                self.comments[comment_id] = comment
+                return 201, {}, comment
+            return self._page(path, query, sorted((c for c in self.comments.values() if c['issue_number'] == number),
+                                                  key=lambda c: c['id']))
+        issue = self.issues[number]['issue']
+        if method == 'PATCH':
+            for field, value in body.items():
+                if field == 'state':
+                    issue['closed'] = value == 'closed'
+                else:
+                    issue[field] = value
+        return 200, {}, dict(issue, number=number)
+
+    def _graphql(self, body, accept):
+        """
+        Runs the aliased fields of a document like the GraphQLBatcher writes them,
+        failed fields get an error with their alias in the path.
+        createLabel is only known with the bane preview in the Accept header, like on github.com.
+        """
+        query = body['query']
+        variables = body.get('variables') or {}
+        data = dict()
+        errors = []
+        with self._lock:
+            if 'repository(owner: $owner, name: $name) { id }' in query:
+                return 200, {}, {'data': {'repository': {'id': 'R_1'}}}
+            for alias, field, arguments in re.findall(r'(o\d+): (\w+)\(([^)]*)\)', query):
+                self.graphql_operations += 1
+                values = dict((name, variables[variable])
+                              for name, variable in re.findall(r'(\w+): \$(\w+)', arguments))
+                try:
+                    if field == 'createLabel' and 'bane-preview' not in accept:
+                        raise LookupError("Field 'createLabel' doesn't exist on type 'Mutation'")
+                    data[alias] = self._graphql_field(field, values)
+                except LookupError as e:
+                    data[alias] = None
+                    errors.append({'path': [alias], 'message': str(e)})
+        if query.startswith('query'):
+            data = {'repository': data}
+        response = {'data': data}
+        if errors:
+            response['errors'] = errors
+        return 200, {}, response
+
+    def _graphql_field(self, field, values):
+        if field == 'createLabel':
+            data = values['input']
+            if data['name'].lower() in self.labels:
+                raise LookupError('Name has already been taken')
+            self.labels[data['name'].lower()] = {'name': data['name'], 'color': data['color']}
+            return {'label': {'name': data['name']}}
+        if field == 'updateIssueComment':
+            data = values['input']
+            comment = next((c for c in self.comments.values() if c['node_id'] == data['id']), None)
+            if comment is None:
+                raise LookupError('Could not resolve to a node with the global id of ' + repr(data['id']))
+            comment['body'] = data['body']
+            comment['updated_at'] = _now()
+            return {'clientMutationId': None}
+        if field == 'issue':
+            if values['number'] not in self.issues:
+                raise LookupError('Could not resolve to an issue with the number of %d' % values['number'])
+            return {'comments': {'nodes': [{'id': c['node_id']} for c in sorted(
+                self.comments.values(), key=lambda c: c['id']) if c['issue_number'] == values['number']][:100]}}
+        raise LookupError('Unknown field ' + field)
+
+    def _create_import(self, body):
+        import_id = next(self._import_ids)
+        self.imports[import_id] = {'id': import_id, 'status': 'pending', 'created_at': _now(),
+                                   'updated_at': _now(), 'payload': body}
+        self._queue.append(import_id)
+        self._queued.notify()
+        return 202, {}, self._import_status(self.imports[import_id])
+
+    def _import_status(self, entry):
+        return dict((k, v) for k, v in entry.items() if k != 'payload')
+
+    def _process_imports(self):
+        while True:
+            with self._lock:
+                while not self._queue and not self._stopped:
+                    self._queued.wait()
+                if self._stopped:
+                    return
+            time.sleep(self.import_delay)
+            with self._lock:
+                entry = self.imports[self._queue.pop(0)]
+                entry['updated_at'] = _now()
+                if self.import_failure_rate and self._rng.random() < self.import_failure_rate:
+                    entry['status'] = 'failed'
+                    entry['errors'] = [{'location': '/issue', 'code': 'invalid'}]
+                    continue
+                number = self._next_issue
+                self._next_issue += 1
+                entry['status'] = 'imported'
+                entry['issue_url'] = '%s/repos/owner/repo/issues/%d' % (self.url, number)
+                self.issues[number] = entry['payload']
+                for comment in entry['payload'].get('comments', []):
+                    comment_id = next(self._comment_ids)
+                    self.comments[comment_id] = {'id': comment_id, 'node_id': 'IC_%d' % comment_id,
+                                                 'body': comment['body'],
+                                                 'issue_number': number,
+                                                 'created_at': comment.get('created_at', entry['updated_at']),
+                                                 'updated_at': entry['updated_at']}
+
+
+def _handler(github):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _serve(self, method):
+            url = urlsplit(self.path)
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length)) if length else None
+            status, headers, data = github.handle(method, url.path, parse_qs(url.query), body,
+                                                  self.headers.get('If-None-Match'), self.headers.get('Accept'))
+            # a 304 has no body
+            encoded = json.dumps(data).encode() if status != 304 else b''
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Type', 'application/json')
+            if status != 304:
+                self.send_header('Content-Length', str(len(encoded)))
+            self.end_headers()
+            self.wfile.write(encoded)
+
+        def do_GET(self):
+            self._serve('GET')
+
+        def do_POST(self):
+            self._serve('POST')
+
+        def do_PATCH(self):
+            self._serve('PATCH')
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs a local fake GitHub API.')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='share of requests answered with 502')
+    parser.add_argument('--import-delay', type=float, default=0.05, help='seconds GitHub takes per import')
+    parser.add_argument('--import-failure-rate', type=float, default=0.0, help='share of imports that fail')
+    parser.add_argument('--lost-response-rate', type=float, default=0.0,
+                        help='share of import uploads that are queued but answered with 502')
+    parser.add_argument('--rate-limit', type=int, default=None, help='requests allowed per rate limit window')
+    parser.add_argument('--rate-limit-window', type=float, default=60.0, help='seconds per rate limit window')
+    args = parser.parse_args()
+    github = FakeGitHub(args.latency, args.failure_rate, args.import_delay, args.import_failure_rate,
+                        port=args.port, rate_limit=args.rate_limit,
+                        rate_limit_window=args.rate_limit_window,
+                        lost_response_rate=args.lost_response_rate).start()
+    print('Fake GitHub API listening on', github.url)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        github.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+A local stand-in for the attachment downloads of a JIRA server, for benchmarks and
+offline experiments with the attachment mirroring.
+
+    python benchmarks/fake_jira.py --port 8001 --latency 0.05
+
+then point the mirroring at it with `main.py --mirror-attachments ... --jira-url http://127.0.0.1:8001`.
+Every attachment id serves a PNG-typed body derived from the id modulo --distinct,
+so several ids share the same content.
+"""
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import hashlib
+import re
+import threading
+import time
+
+
+class FakeJira:
+    """
+    Serves /secure/attachment/<id>/<name> and /secure/thumbnail/<id>/<name>,
+    ids in missing are answered with 404. The requests per path are counted.
+    """
+
+    def __init__(self, latency=0.0, distinct=None, missing=(), size=4096, port=0):
+        self.latency = latency
+        self.distinct = distinct
+        self.missing = set(missing)
+        self.size = size
+        self.requests = Counter()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), _handler(self))
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self._server.server_port
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def handle(self, path):
+        """
+        Returns status and body of the response to a GET request.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.requests[path] += 1
+        m = re.fullmatch(r'/secure/(?:attachment|thumbnail)/(\d+)/[^/]+', path)
+        if not m or int(m[1]) in self.missing:
+            return 404, b'Not Found'
+        return 200, self.content(int(m[1]))
+
+    def content(self, attachment_id):
+        seed = attachment_id % self.distinct if self.distinct else attachment_id
+        block = hashlib.sha256(str(seed).encode()).digest()
+        return b'\x89PNG\r\n\x1a\n' + (block * (self.size // len(block) + 1))[:self.size]
+
+
+def _handler(jira):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            status, body = jira.handle(self.path.split('?', 1)[0])
+            self.send_response(status)
+            self.send_header('Content-Type', 'image/png' if status == 200 else 'text/plain')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs a local fake JIRA attachment server.')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--distinct', type=int, default=None, help='number of distinct attachment contents')
+    parser.add_argument('--size', type=int, default=4096, help='bytes per attachment')
+    args = parser.parse_args()
+    jira = FakeJira(args.latency, args.distinct, size=args.size, port=args.port).start()
+    print('Fake JIRA attachments served on', jira.url)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        jira.stop()
+
+
+if __name__ == '__main__':
+    main()
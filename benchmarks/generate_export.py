@@ -0,0 +1,163 @@
+"""
+Generates synthetic JIRA RSS/XML exports shaped like the ones the importer reads.
+
+    python benchmarks/generate_export.py out.xml --issues 1000 --start 1 --comments 3
+
+Issue keys run from --start upwards, so several files with consecutive ranges
+behave like the split exports described in the README.
+"""
+from datetime import datetime, timedelta, timezone
+from xml.sax.saxutils import escape, quoteattr
+import argparse
+import random
+
+_WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor '
+          'incididunt ut labore et dolore magna aliqua').split()
+_TYPES = ('Bug', 'Task', 'Story', 'Improvement')
+_COMPONENTS = ('Core', 'UI', 'API', 'Docs', 'Build')
+_LABELS = ('backend', 'frontend', 'performance', 'security', 'regression')
+_VERSIONS = ('1.0', '1.1', '2.0', '2.1')
+_LINKS = (('Duplicate', 'duplicates', 'is duplicated by'),
+          ('Relates', 'relates to', 'is related to'),
+          ('Blocks', 'blocks', 'is blocked by'),
+          ('Dependency', 'depends on', 'is depended on by'))
+_ENTITIES = ('&amp;', '&lt;', '&gt;', '&quot;', '&nbsp;', '&eacute;', '&copy;', '&hellip;')
+
+
+class ExportGenerator:
+    """
+    Builds the items of a synthetic export. The knobs are the average number of comments
+    per issue and the probabilities of links, mentions, images and entities per text.
+    """
+
+    def __init__(self, project='PRO', base_url='https://example.atlassian.net', users=200,
+                 comments=3.0, links=0.3, mentions=0.2, images=0.1, entities=0.3,
+                 text_words=60, seed=42, attachments=10 ** 6):
+        self.project = project
+        self.base_url = base_url
+        self.comments = comments
+        self.links = links
+        self.mentions = mentions
+        self.images = images
+        self.entities = entities
+        self.text_words = text_words
+        self.attachments = attachments
+        self._rng = random.Random(seed)
+        self._users = [('%06x:%s' % (self._rng.randrange(16 ** 6), '%032x' % self._rng.randrange(16 ** 32)),
+                        'User %d' % index) for index in range(users)]
+
+    def write(self, file_name, issues, start=1):
+        with open(file_name, 'w', encoding='utf-8') as out:
+            out.write('<?xml version="1.0" encoding="UTF-8"?>\n<rss version="0.92">\n<channel>\n'
+                      '    <title>Jira</title>\n    <link>%s</link>\n'
+                      '    <description>An XML representation of a search request</description>\n'
+                      '    <language>en-us</language>\n' % escape(self.base_url))
+            for number in range(start, start + issues):
+                out.write(self.item(number, start + issues - 1))
+            out.write('</channel>\n</rss>\n')
+
+    def item(self, number, last_number):
+        rng = self._rng
+        key = '%s-%d' % (self.project, number)
+        link = '%s/browse/%s' % (self.base_url, key)
+        created = datetime(2015, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=97 * number)
+        reporter = rng.choice(self._users)
+        assignee = rng.choice(self._users) if rng.random() < 0.7 else ('-1', 'Unassigned')
+        summary = self._sentence(8)
+
+        parts = ['<item>\n',
+                 '    <title>%s</title>\n' % escape('[%s] %s' % (key, summary)),
+                 '    <link>%s</link>\n' % escape(link),
+                 '    <project id="10000" key=%s>Project</project>\n' % quoteattr(self.project),
+                 '    <description>%s</description>\n' % escape(self._html_text(number, last_number)),
+                 '    <key id="%d">%s</key>\n' % (number, key),
+                 '    <summary>%s</summary>\n' % escape(summary),
+                 '    <type id="1">%s</type>\n' % rng.choice(_TYPES),
+                 '    <assignee accountid=%s>%s</assignee>\n' % (quoteattr(assignee[0]), escape(assignee[1])),
+                 '    <reporter accountid=%s>%s</reporter>\n' % (quoteattr(reporter[0]), escape(reporter[1])),
+                 '    <created>%s</created>\n' % self._timestamp(created),
+                 '    <updated>%s</updated>\n' % self._timestamp(created + timedelta(days=2))]
+        if rng.random() < 0.5:
+            parts.append('    <resolved>%s</resolved>\n' % self._timestamp(created + timedelta(days=5)))
+        if rng.random() < 0.6:
+            parts.append('    <fixVersion>%s</fixVersion>\n' % rng.choice(_VERSIONS))
+        if rng.random() < 0.7:
+            parts.append('    <component>%s</component>\n' % rng.choice(_COMPONENTS))
+        if rng.random() < 0.5:
+            parts.append('    <labels>\n%s    </labels>\n' % ''.join(
+                '        <label>%s</label>\n' % label for label in rng.sample(_LABELS, rng.randint(1, 2))))
+        if number > 1 and rng.random() < self.links:
+            name, outward, inward = rng.choice(_LINKS)
+            direction, description = rng.choice((('outwardlinks', outward), ('inwardlinks', inward)))
+            other = rng.randrange(1, number)
+            parts.append('    <issuelinks>\n        <issuelinktype id="10000">\n'
+                         '            <name>%s</name>\n'
+                         '            <%s description=%s>\n'
+                         '                <issuelink><issuekey id="%d">%s-%d</issuekey></issuelink>\n'
+                         '            </%s>\n        </issuelinktype>\n    </issuelinks>\n'
+                         % (name, direction, quoteattr(description), other, self.project, other, direction))
+
+        comment_count = int(rng.expovariate(1 / self.comments)) if self.comments else 0
+        if comment_count:
+            parts.append('    <comments>\n')
+            for index in range(comment_count):
+                author = rng.choice(self._users)
+                parts.append('        <comment id="%d" author=%s created="%s">%s</comment>\n' % (
+                    number * 1000 + index, quoteattr(author[0]),
+                    self._timestamp(created + timedelta(hours=index + 1)),
+                    escape(self._html_text(number, last_number))))
+            parts.append('    </comments>\n')
+        parts.append('</item>\n')
+        return ''.join(parts)
+
+    def _html_text(self, number, last_number):
+        rng = self._rng
+        words = []
+        for _ in range(self.text_words):
+            words.append(rng.choice(_WORDS))
+            if rng.random() < self.entities / 10:
+                words.append(rng.choice(_ENTITIES))
+        if rng.random() < self.links:
+            words.append('%s-%d' % (self.project, rng.randint(1, last_number)))
+        if rng.random() < self.mentions:
+            user = rng.choice(self._users)
+            words.append('<a href="%s/secure/ViewProfile.jspa?accountId=%s" class="user-hover" accountid="%s">%s</a>'
+                         % (self.base_url, user[0], user[0], user[1]))
+        if rng.random() < self.images:
+            words.append('<img src="/secure/attachment/%d/screenshot-%d.png" alt="" border="0"/>'
+                         % (rng.randrange(self.attachments), number))
+        if rng.random() < self.links:
+            words.append('<a href="/browse/%s-%d">link</a>' % (self.project, rng.randint(1, last_number)))
+        return '<p>' + ' '.join(words) + '</p>'
+
+    def _sentence(self, length):
+        return ' '.join(self._rng.choice(_WORDS) for _ in range(length)).capitalize()
+
+    def _timestamp(self, moment):
+        return moment.strftime('%a, ') + str(moment.day) + moment.strftime(' %b %Y %H:%M:%S +0000')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generates a synthetic JIRA XML export.')
+    parser.add_argument('file_name')
+    parser.add_argument('--issues', type=int, default=1000)
+    parser.add_argument('--start', type=int, default=1, help='number of the first issue key')
+    parser.add_argument('--project', default='PRO')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--comments', type=float, default=3.0, help='average comments per issue')
+    parser.add_argument('--links', type=float, default=0.3, help='probability of issue links and references')
+    parser.add_argument('--mentions', type=float, default=0.2, help='probability of a mention per text')
+    parser.add_argument('--images', type=float, default=0.1, help='probability of an image per text')
+    parser.add_argument('--attachments', type=int, default=10 ** 6,
+                        help='number of distinct attachment ids the images are drawn from')
+    parser.add_argument('--entities', type=float, default=0.3, help='density of HTML entities')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    generator = ExportGenerator(args.project, users=args.users, comments=args.comments, links=args.links,
+                                mentions=args.mentions, images=args.images, entities=args.entities,
+                                seed=args.seed, attachments=args.attachments)
+    generator.write(args.file_name, args.issues, args.start)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from graphqlbatch import GraphQLError, Operation
+from journal import Journal
+import hashlib
+import json
+
+
+def _digest(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()[:32]
+
+
+def issue_fingerprint(issue, payload):
+    """
+    Fingerprints the parts of an issue payload that can be changed on GitHub afterwards.
+    The milestone goes in by name, its id differs between repositories.
+    """
+    data = payload['issue']
+    return _digest([data['title'], data['body'], sorted(data['labels']), data['closed'], issue.milestone_name])
+
+
+def comment_fingerprints(payload):
+    return [_digest(comment['body']) for comment in payload['comments']]
+
+
+class DeltaSync:
+    """
+    Brings a repository imported earlier up to date with a later export.
+    Issues the journal does not know as imported are imported as usual. Imported issues whose
+    JIRA update time did not change are skipped without building their payload, the others
+    are compared with the fingerprints kept in the journal: a changed title, description,
+    label set, state or milestone is patched on the existing GitHub issue, changed comments
+    are patched and new ones appended, with the issue references in them resolved and
+    the account ids replaced the way the post-processing pass would have done it.
+    Comments are matched by their position, GitHub comments are only listed for issues
+    with changed comments. With GraphQL batching the changed comments of all issues are
+    looked up and patched in batches once the issues are done.
+    """
+    _LOOKUP_COMMENTS = 100
+
+    def __init__(self, importer):
+        self._importer = importer
+        self._journal = importer.journal
+
+    def run(self):
+        importer = self._importer
+        new = []
+        outdated = []
+        baseline = 0
+        for issue in importer.project.get_issues():
+            entry = self._journal.get_issue(issue.key)
+            if entry is None or entry.state != Journal.IMPORTED:
+                new.append(issue)
+                continue
+            issue.githubid = entry.github_id
+            if entry.updated_at == issue.updated_at:
+                continue
+            payload = importer.build_issue_payload(issue)
+            if entry.fingerprint is None:
+                # imported before fingerprints were kept, what was sent back then is unknown
+                self._journal.issue_synced(issue.key, issue.updated_at, issue_fingerprint(issue, payload),
+                                           comment_fingerprints(payload))
+                baseline += 1
+                continue
+            outdated.append((issue, entry, payload))
+
+        if baseline:
+            print('Recorded the current state of %d issues imported before changes were tracked, '
+                  'changes made to them before this export are not synced' % baseline)
+        print('Syncing %d changed issues, importing %d new ones' % (len(outdated), len(new)))
+        # the new issues go first, so the comments patched or appended can refer to their GitHub ids
+        if new:
+            importer.import_issues(new)
+        self._update(outdated)
+
+    def _update(self, outdated):
+        """
+        Updates the changed issues a few at a time, each issue is noted in the journal as soon as it is done.
+        """
+        importer = self._importer
+        deferred = []
+        with ThreadPoolExecutor(max_workers=importer.max_concurrent_requests) as executor:
+            # SQLite connections stay on the thread that opened them, the journal is only used here
+            futures = [executor.submit(self._update_issue, issue, entry, payload,
+                                       self._journal.get_comment_fingerprints(issue.key))
+                       for issue, entry, payload in outdated]
+            for future in as_completed(futures):
+                issue, payload, fingerprint, fingerprints, known, changed = future.result()
+                if changed:
+                    deferred.append((issue, payload, fingerprint, fingerprints, known, changed))
+                else:
+                    self._journal.issue_synced(issue.key, issue.updated_at, fingerprint, fingerprints)
+        if deferred:
+            self._update_comments_batched(deferred)
+
+    def _update_comments_batched(self, deferred):
+        """
+        Looks up the node ids of the changed comments and patches them with batched GraphQL requests.
+        A comment that failed keeps its old fingerprint in the journal, so the next sync retries it.
+        """
+        importer = self._importer
+        found = importer.graphql.lookup(importer.options.account, importer.options.repo, [
+            Operation('issue', {'number': ('Int!', issue.githubid)},
+                      '{ comments(first: %d) { nodes { id } } }' % DeltaSync._LOOKUP_COMMENTS)
+            for issue, payload, fingerprint, fingerprints, known, changed in deferred])
+        patches = []
+        failures = []
+        for (issue, payload, fingerprint, fingerprints, known, changed), result in zip(deferred, found):
+            if isinstance(result, GraphQLError) or not result:
+                failures.append('comments of %s: %s' % (issue.key, result))
+                for position in changed:
+                    fingerprints[position] = known[position]
+                continue
+            node_ids = [node['id'] for node in result['comments']['nodes']]
+            if max(changed) >= DeltaSync._LOOKUP_COMMENTS:
+                node_ids = [comment['node_id'] for comment in
+                            importer.run_api_pages('/issues/%d/comments' % issue.githubid)]
+            for position in changed:
+                if position >= len(node_ids):
+                    print('Warning: comment', position + 1, 'of', issue.key, 'is missing on GitHub')
+                    continue
+                patches.append((issue, fingerprints, known, position, node_ids[position],
+                                importer.final_comment_body(payload['comments'][position]['body'])))
+
+        results = importer.graphql.mutate([
+            Operation('updateIssueComment', {'input': ('UpdateIssueCommentInput!', {'id': node_id, 'body': body})},
+                      '{ clientMutationId }')
+            for issue, fingerprints, known, position, node_id, body in patches])
+        for (issue, fingerprints, known, position, node_id, body), result in zip(patches, results):
+            if isinstance(result, GraphQLError):
+                failures.append('comment %d of %s: %s' % (position + 1, issue.key, result))
+                fingerprints[position] = known[position]
+            else:
+                importer.metrics.count('comments_updated')
+
+        for issue, payload, fingerprint, fingerprints, known, changed in deferred:
+            self._journal.issue_synced(issue.key, issue.updated_at, fingerprint, fingerprints)
+        if failures:
+            raise RuntimeError('Failed to update comments, rerun to retry:\n' + '\n'.join(failures))
+
+    def _update_issue(self, issue, entry, payload, known):
+        importer = self._importer
+        issue_url = '/issues/%d' % entry.github_id
+        fingerprint = issue_fingerprint(issue, payload)
+        if fingerprint != entry.fingerprint:
+            data = payload['issue']
+            print('Updating', issue.key, 'as GitHub issue', entry.github_id)
+            importer.run_api(issue_url, method='PATCH', payload={
+                'title': data['title'], 'body': data['body'], 'labels': data['labels'],
+                'state': 'closed' if data['closed'] else 'open',
+                'milestone': importer.milestone_ids.get(issue.milestone_name)})
+            importer.metrics.count('issues_updated')
+
+        fingerprints = comment_fingerprints(payload)
+        changed = [position for position in range(min(len(known), len(fingerprints)))
+                   if known[position] != fingerprints[position]]
+        # with GraphQL batching the changed comments are patched later, together with those of the other issues
+        if changed and not importer.graphql:
+            existing = list(importer.run_api_pages(issue_url + '/comments'))
+            for position in changed:
+                if position >= len(existing):
+                    print('Warning: comment', position + 1, 'of', issue.key, 'is missing on GitHub')
+                    continue
+                importer.run_api('/issues/comments/%d' % existing[position]['id'], method='PATCH',
+                                 payload={'body': importer.final_comment_body(payload['comments'][position]['body'])})
+                importer.metrics.count('comments_updated')
+            changed = []
+        for comment in payload['comments'][len(known):]:
+            # appended comments get the current time, the REST API cannot backdate them
+            importer.run_api(issue_url + '/comments', method='POST',
+                             payload={'body': importer.final_comment_body(comment['body'])})
+            importer.metrics.count('comments_appended')
+        if len(fingerprints) < len(known):
+            print('Warning:', len(known) - len(fingerprints), 'comments of', issue.key,
+                  'were removed in JIRA, they are kept on GitHub')
+            fingerprints = fingerprints + known[len(fingerprints):]
+        return issue, payload, fingerprint, fingerprints, known, changed
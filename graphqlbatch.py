@@ -0,0 +1,163 @@
+from concurrent.futures import ThreadPoolExecutor
+from scheduler import TokenBucket
+from transport import ApiError
+import threading
+import time
+
+
+class GraphQLError(RuntimeError):
+    """
+    A GraphQL operation that failed. The batcher returns it in place of the result of the operation,
+    the other operations of the same request are not affected.
+    """
+
+
+class Operation:
+    """
+    One field of a batched GraphQL request, a mutation or a lookup in the repository.
+    The arguments map names to pairs of GraphQL type and value, they are sent as variables.
+    """
+    __slots__ = ('field', 'arguments', 'selection')
+
+    def __init__(self, field, arguments, selection):
+        self.field = field
+        self.arguments = arguments
+        self.selection = selection
+
+
+class GraphQLBatcher:
+    """
+    Combines many GraphQL operations into few requests: up to batch_size mutations or repository
+    lookups go into one document as aliased fields, a few such requests are sent at a time.
+    Results are returned in operation order, failed operations get a GraphQLError instead.
+    Mutations are paced below GitHub's secondary limit of 2000 points per minute at 5 points each.
+    """
+    _DEFAULT_BATCH_SIZE = 50
+    _DEFAULT_MUTATIONS_PER_MINUTE = 400
+
+    def __init__(self, scheduler, url='/graphql', batch_size=_DEFAULT_BATCH_SIZE, max_concurrent=4,
+                 mutations_per_minute=_DEFAULT_MUTATIONS_PER_MINUTE):
+        self.scheduler = scheduler
+        self.url = url
+        self.batch_size = max(1, batch_size)
+        self.max_concurrent = max(1, max_concurrent)
+        self._mutations = TokenBucket(mutations_per_minute / 60.0, max(self.batch_size, 1))
+        self._lock = threading.Lock()
+        self._repository_ids = dict()
+
+    def mutate(self, operations, previews=()):
+        """
+        Runs the mutations and returns their results. Mutations that GitHub still ships as schema
+        previews, like createLabel behind bane, only exist when their previews are named.
+        """
+        headers = {'Accept': ', '.join('application/vnd.github.%s-preview+json' % preview
+                                       for preview in previews)} if previews else {}
+        return self._run(operations, lambda batch: self._mutation(batch, headers))
+
+    def lookup(self, owner, repo, operations):
+        """
+        Runs the lookups as fields of the repository and returns their results,
+        None for things that do not exist.
+        """
+        return self._run(operations, lambda batch: self._lookup(owner, repo, batch))
+
+    def repository_id(self, owner, repo):
+        """
+        Returns the node id of the repository, mutations refer to it by that.
+        """
+        key = (owner, repo)
+        if key not in self._repository_ids:
+            response = self._send('query($owner: String!, $name: String!) '
+                                  '{ repository(owner: $owner, name: $name) { id } }',
+                                  {'owner': owner, 'name': repo})
+            if response.get('errors') or not (response.get('data') or {}).get('repository'):
+                raise RuntimeError('Unable to look up %s/%s: %r' % (owner, repo, response.get('errors')))
+            self._repository_ids[key] = response['data']['repository']['id']
+        return self._repository_ids[key]
+
+    def _run(self, operations, send_batch):
+        batches = [operations[i:i + self.batch_size] for i in range(0, len(operations), self.batch_size)]
+        if len(batches) <= 1:
+            results = [send_batch(batch) for batch in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_concurrent) as executor:
+                results = list(executor.map(send_batch, batches))
+        results = [result for batch in results for result in batch]
+        metrics = self.scheduler.metrics
+        if metrics:
+            metrics.count('graphql_operations', len(results))
+            metrics.count('graphql_failed_operations', sum(isinstance(r, GraphQLError) for r in results))
+        return results
+
+    def _mutation(self, batch, headers):
+        self._pace(len(batch))
+        declarations, fields, variables = self._document(batch)
+        return self._results(batch, lambda: self._send('mutation(%s) { %s }' % (declarations, fields), variables,
+                                                       headers),
+                             lambda data: data)
+
+    def _lookup(self, owner, repo, batch):
+        declarations, fields, variables = self._document(batch)
+        variables.update(owner=owner, name=repo)
+        query = ('query(%s, $owner: String!, $name: String!) '
+                 '{ repository(owner: $owner, name: $name) { %s } }' % (declarations, fields))
+        return self._results(batch, lambda: self._send(query, variables),
+                             lambda data: data.get('repository') or {})
+
+    def _document(self, batch):
+        declarations = []
+        fields = []
+        variables = dict()
+        for index, operation in enumerate(batch):
+            arguments = []
+            for name, (kind, value) in operation.arguments.items():
+                variable = 'v%d_%s' % (index, name)
+                declarations.append('$%s: %s' % (variable, kind))
+                arguments.append('%s: $%s' % (name, variable))
+                variables[variable] = value
+            fields.append('o%d: %s(%s) %s' % (index, operation.field, ', '.join(arguments), operation.selection))
+        return ', '.join(declarations), ' '.join(fields), variables
+
+    def _results(self, batch, send, scope):
+        """
+        Splits the response of a batch back into the results of its operations.
+        Errors name the failed operation by its alias in their path, errors without one fail the whole batch.
+        """
+        try:
+            response = send()
+        except ApiError as e:
+            return [GraphQLError(str(e))] * len(batch)
+        data = scope(response.get('data') or {})
+        failed = dict()
+        general = []
+        for error in response.get('errors') or []:
+            alias = next((step for step in error.get('path') or []
+                          if isinstance(step, str) and step[:1] == 'o' and step[1:].isdigit()), None)
+            if alias is None:
+                general.append(error.get('message', repr(error)))
+            else:
+                failed.setdefault(alias, []).append(error.get('message', repr(error)))
+        results = []
+        for index in range(len(batch)):
+            alias = 'o%d' % index
+            if alias in failed:
+                results.append(GraphQLError('; '.join(failed[alias])))
+            elif general or alias not in data:
+                results.append(GraphQLError('; '.join(general) or 'No result for the operation'))
+            else:
+                results.append(data[alias])
+        return results
+
+    def _send(self, query, variables, headers={}):
+        return self.scheduler.request('POST', self.url, payload={'query': query, 'variables': variables},
+                                      headers=headers).data
+
+    def _pace(self, count):
+        with self._lock:
+            while True:
+                delay = self._mutations.delay(count - 1.0)
+                if delay <= 0:
+                    break
+                time.sleep(delay)
+            for _ in range(count):
+                self._mutations.take()
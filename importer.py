@@ -1,7 +1,16 @@
-import json
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+from deltasync import DeltaSync, comment_fingerprints, issue_fingerprint
+from graphqlbatch import GraphQLError, Operation
+from importstatus import ImportStatusTracker
+from journal import Journal
+from metrics import Metrics
+from records import Comment, Link
+from rewriter import LiteralRewriter, Rewriter
+from scheduler import RequestScheduler
+from transport import GhCliTransport, Response, next_page_url
 import re
-import subprocess
-import time
 
 
 class Importer:
@@ -9,179 +18,459 @@ class Importer:
     _PLACEHOLDER_PREFIX = "@PSTART"
     _PLACEHOLDER_SUFFIX = "@PEND"
     _DEFAULT_TIME_OUT = 120.0
-
-    def __init__(self, options, project):
+    _DEFAULT_MAX_IN_FLIGHT = 8
+    _DEFAULT_MAX_CONCURRENT_REQUESTS = 4
+    _CLOCK_SKEW = timedelta(minutes=5)
+    _LINK_COMMENT_PREFIXES = {'duplicates': 'Duplicates: ',
+                              'is-duplicated-by': 'Is duplicated by: ',
+                              'is-related-to': 'Is related to: ',
+                              'depends-on': 'Depends on: ',
+                              'blocks': 'Blocks: '}
+    _IMPORT_FOOTER = '\n\n<i>Imported from <a href="'
+    _PLACEHOLDER_PATTERN = re.compile(re.escape(_PLACEHOLDER_PREFIX) + '(' + _GITHUB_ISSUE_PREFIX +
+                                      r')?(\d+)' + re.escape(_PLACEHOLDER_SUFFIX))
+
+    def __init__(self, options, project, transport=None, max_in_flight=_DEFAULT_MAX_IN_FLIGHT,
+                 journal=None, resolve_references=False, metrics=None, scheduler=None, graphql=None):
         self.options = options
         self.project = project
+        self.transport = transport or GhCliTransport()
+        self.max_in_flight = max(1, max_in_flight)
+        self.journal = journal
+        self.resolve_references = resolve_references
+        self.metrics = metrics or Metrics()
+        self.scheduler = scheduler or RequestScheduler(self.transport, self.metrics)
+        # label creation and comment patches go through batched GraphQL requests when set
+        self.graphql = graphql
+        self.max_concurrent_requests = Importer._DEFAULT_MAX_CONCURRENT_REQUESTS
+        self._resolved_references = 0
+        self._placeholders_written = False
+        self._writing_body = False
+        self._import_started_at = None
+        # the imports uploaded in this run, the journal keeps them across runs
+        self._import_ids = set()
+        self._last_github_id = None
+        # the GitHub numbers of the issues imported in this run, the journal keeps them across runs
+        self._github_ids = dict()
+        self._issue_total = 0
         self.github_url = '/repos/%s/%s' % (self.options.account, self.options.repo)
+        self.milestone_ids = dict()
+        self._existing_milestones = None
+        self._existing_labels = None
+        self._reference_project = None
+        self._prepare_reference_patterns()
+        self._user_id_rewriter = None
+        self._user_id_count = -1
+
+    def _prepare_reference_patterns(self):
+        """
+        Builds the patterns of JIRA issue references, which depend on the project name.
+        A streamed project only learns its name from the first export item.
+        """
+        if self._reference_project == self.project.name:
+            return
+        self._reference_project = self.project.name
         self.jira_issue_replace_patterns = {
             'https://java.net/jira/browse/%s%s' % (self.project.name, r'-(\d+)'): r'\1',
             self.project.name + r'-(\d+)': Importer._GITHUB_ISSUE_PREFIX + r'\1',
             r'Issue (\d+)': Importer._GITHUB_ISSUE_PREFIX + r'\1'}
-
-    def run_api(self, url, method='GET', payload=None, params={}):
-        command = ['gh', 'api', '-X', method, self.github_url + url, ]
-        for pk in params:
-            command.append('-f')
-            command.append(pk + '=' + params[pk])
-        if payload:
-            command.append('--input')
-            command.append('-')
-        # print('Running API command:', repr(command))
-        if payload:
-            bytes_in = json.dumps(payload).encode()
-            # print('Using input:', bytes_in)
+        if self.resolve_references:
+            # all reference patterns are matched in one pass over the text
+            self._reference_rewriter = Rewriter(
+                [(pattern, self._issue_reference_callback(replacement))
+                 for pattern, replacement in self.jira_issue_replace_patterns.items()])
+            self._placeholder_templates = None
         else:
-            bytes_in = None
-        result = subprocess.run(command, capture_output=True, input=bytes_in)
-        # print('Receive API result:', repr(result))
-        if result.returncode:
-            raise RuntimeError('Failure return code ' +
-                               repr(result.returncode) +
-                               ' from command:\n' + repr(result.stdout) +
-                               '\n' + repr(result.stderr))
-        j = json.loads(result.stdout)
-        # print('Returning parsed output:', repr(j))
-        return j
+            # every reference becomes a placeholder, re.sub expands a template for that without
+            # calling back into Python per match, which is faster than the single pass
+            self._placeholder_templates = [
+                (re.compile(pattern), Importer._PLACEHOLDER_PREFIX + replacement + Importer._PLACEHOLDER_SUFFIX)
+                for pattern, replacement in self.jira_issue_replace_patterns.items()]
+
+    def run_api(self, url, method='GET', payload=None, params={}, priority=RequestScheduler.HIGH):
+        """
+        Calls the GitHub REST API for the repository through the request scheduler
+        and returns the parsed JSON response.
+        """
+        return self.scheduler.request(method, self.github_url + url, payload, params, priority).data
+
+    def run_api_pages(self, url, params={}):
+        """
+        Yields the items of all pages of a paginated GitHub listing, following the Link headers.
+        """
+        page_params = dict(params)
+        page_params['per_page'] = '100'
+        response = self.scheduler.request('GET', self.github_url + url, params=page_params)
+        while True:
+            yield from response.data
+            next_url = next_page_url(response.headers)
+            if not next_url:
+                break
+            response = self.scheduler.request('GET', next_url)
 
     def import_milestones(self):
         """
-        Imports the gathered project milestones into GitHub and remembers the created milestone ids
+        Imports the gathered project milestones into GitHub and remembers the created milestone ids.
+        All existing milestones are listed first, only the missing ones are created.
         """
-        milestone_url = '/milestones'
-        print('Importing milestones...', milestone_url)
+        print('Importing milestones...', '/milestones')
         print
 
         # Check existing first
-        existing = list()
-
-        def get_next_page_url(url):
-            return url.replace('<', '').replace('>', '').replace('; rel="next"', '')
-
-        milestone_pages = list()
-        ms = self.run_api(milestone_url, params={'state': 'all'})
-        milestone_pages.append(ms)
-
-        for ms_json in milestone_pages:
-            for m in ms_json:
-                if m['title'] in self.project.get_milestones().keys():
-                    self.project.get_milestones()[m['title']] = m['number']
-                    print(m['title'], 'found')
-                    existing.append(m['title'])
-                else:
-                    print(m['title'], 'not used')
+        for title, number in self._list_milestones().items():
+            if title in self.project.get_milestones().keys():
+                self.milestone_ids[title] = number
+                print(title, 'found')
+            else:
+                print(title, 'not used')
 
         # Export new ones
-        for mkey in self.project.get_milestones().keys():
-            if mkey in existing:
-                continue
+        self._create_milestones([mkey for mkey in self.project.get_milestones().keys()
+                                 if mkey not in self.milestone_ids])
 
-            data = {'title': mkey}
-            content = self.run_api(milestone_url, method='POST', payload=data)
+    def _list_milestones(self):
+        return dict((m['title'], m['number']) for m in self.run_api_pages('/milestones', params={'state': 'all'}))
 
-            # overwrite histogram data with the actual milestone id now
-            self.project.get_milestones()[mkey] = content['number']
+    def _create_milestones(self, titles):
+        created = self._run_concurrently(
+            lambda mkey: self.run_api('/milestones', method='POST', payload={'title': mkey}), titles)
+        for mkey, content in zip(titles, created):
+            self.milestone_ids[mkey] = content['number']
             print(mkey)
 
-    def import_labels(self, colourSelector):
+    def import_labels(self, colourSelector, recheck=False):
         """
-        Imports the gathered project components and labels as labels into GitHub 
+        Imports the gathered project components and labels as labels into GitHub.
+        All existing labels are listed first, only the missing ones are created.
+        A finished label import is not repeated unless recheck is set, e.g. for a later export.
         """
         label_url = '/labels'
+        if not recheck and self.journal and self.journal.get_flag('labels_imported'):
+            print('Labels already imported')
+            return
         print('Importing labels...', label_url)
         print
 
+        existing = self._list_labels()
+        missing = []
         for lkey in self.project.get_all_labels().keys():
-            try:
-                self.run_api(label_url + '/' + lkey)
+            if lkey.lower() in existing:
                 print('Skipping label that already exists:', lkey)
-            except RuntimeError as e:
-                # label doesn't exist
+            else:
                 print('Importing label: ' + lkey)
-                data = {'name': lkey,
-                        'color': colourSelector.get_colour(lkey)}
-                self.run_api(label_url, method='POST', payload=data)
+                missing.append(lkey)
+
+        self._create_labels(missing, colourSelector)
+
+        if self.journal:
+            self.journal.set_flag('labels_imported')
+
+    def _list_labels(self):
+        # label names are case insensitive on GitHub
+        return set(label['name'].lower() for label in self.run_api_pages('/labels'))
+
+    def _create_labels(self, names, colourSelector):
+        if self.graphql and names:
+            repository_id = self.graphql.repository_id(self.options.account, self.options.repo)
+            results = self.graphql.mutate([
+                Operation('createLabel', {'input': ('CreateLabelInput!', {
+                    'repositoryId': repository_id, 'name': lkey, 'color': colourSelector.get_colour(lkey)})},
+                    '{ label { name } }')
+                for lkey in names], previews=('bane',))
+            failures = [lkey + ': ' + str(result) for lkey, result in zip(names, results)
+                        if isinstance(result, GraphQLError)]
+            if failures:
+                raise RuntimeError('Failed to create labels:\n' + '\n'.join(failures))
+            return
+        self._run_concurrently(
+            lambda lkey: self.run_api('/labels', method='POST',
+                                      payload={'name': lkey, 'color': colourSelector.get_colour(lkey)}),
+            names)
+
+    def _run_concurrently(self, function, items):
+        """
+        Calls the function for all items on a bounded thread pool and returns the results in item order.
+        """
+        if len(items) <= 1:
+            return [function(item) for item in items]
+        with ThreadPoolExecutor(max_workers=self.max_concurrent_requests) as executor:
+            return list(executor.map(function, items))
 
-    def import_issues(self, start_from_count):
+    def import_issues(self, issues=None):
         """
-        Starts the issue import into GitHub:
-        First the milestone id is captured for the issue.
-        Then JIRA issue relationships are converted into comments.
-        After that, the comments are taken out of the issue and 
-        references to JIRA issues in comments are replaced with a placeholder    
+        Starts the issue import into GitHub, of all issues of the project unless others are given:
+        Each issue is turned into an Issue Import API payload, see build_issue_payload.
+        References to JIRA issues in comments are replaced with a placeholder,
+        or with the final GitHub reference right away when resolve_references is set.
+        Up to max_in_flight imports are kept pending on GitHub at the same time.
+        Issues the journal knows as imported are skipped, imports that were still pending
+        when a previous run stopped are waited for instead of being sent again.
         """
         print('Importing issues...')
+        if issues is None:
+            issues = self.project.get_issues()
+        self._import(issues, len(issues), self.build_issue_payload)
 
-        count = 0
+    def sync_issues(self):
+        """
+        Imports new issues and updates the changed ones of a repository imported before, see DeltaSync.
+        """
+        if not self.journal:
+            raise RuntimeError('Syncing changes needs the journal of the earlier import')
+        DeltaSync(self).run()
 
-        for issue in self.project.get_issues():
-            if start_from_count > count:
+    def import_stream(self, batches, colourSelector):
+        """
+        Imports issues while the exports are still being parsed, see pipeline.ProjectStream.
+        Each partial project is merged into the project and the milestones and labels its issues
+        use are created when they are first seen, then its issues are imported like in import_issues.
+        Issues are dropped from the project once they are handed to the import,
+        so references can only be resolved on upload to issues that were parsed before.
+        The exports have to list the issues in key order without overlaps, issues cannot be sorted
+        or told apart from a later version once they are imported, so the import stops with a
+        RuntimeError at the first issue whose key is not above the one handed to the import before.
+        """
+        print('Importing issues while parsing...')
+        self._existing_milestones = self._list_milestones()
+        self._existing_labels = self._list_labels()
+        self._import(self._streamed_issues(batches, colourSelector), None, self.build_issue_payload)
+
+    def _streamed_issues(self, batches, colourSelector):
+        last_key = None
+        last_number = 0
+        for batch in batches:
+            self.project.merge(batch)
+            issues = []
+            for issue in self.project.take_issues():
+                number = int(issue.key.rsplit('-', 1)[-1])
+                if number <= last_number:
+                    raise RuntimeError('%s comes after %s in the exports, streaming needs exports that list '
+                                       'the issues in key order without overlaps, import them without --stream'
+                                       % (issue.key, last_key))
+                last_key = issue.key
+                last_number = number
+                issues.append(issue)
+            self._create_first_seen(issues, colourSelector)
+            yield from issues
+
+    def _create_first_seen(self, issues, colourSelector):
+        """
+        Creates the milestones and labels used by the issues that do not exist on GitHub yet.
+        """
+        titles = []
+        labels = []
+        for issue in issues:
+            title = issue.milestone_name
+            if title is not None and title not in self.milestone_ids and title not in titles:
+                if title in self._existing_milestones:
+                    self.milestone_ids[title] = self._existing_milestones[title]
+                else:
+                    titles.append(title)
+            for label in issue.labels:
+                if label.lower() not in self._existing_labels and label not in labels:
+                    labels.append(label)
+        self._create_milestones(titles)
+        for label in labels:
+            print('Importing label: ' + label)
+        self._create_labels(labels, colourSelector)
+        self._existing_labels.update(label.lower() for label in labels)
+
+    def replay_issues(self, records, total):
+        """
+        Imports issues from payloads built earlier, e.g. read from a payload file.
+        Each record has the key and the payload of an issue and the name of its milestone,
+        whose id is only filled in now. Otherwise this works like import_issues, including the resume.
+        """
+        print('Replaying issues...')
+        self._import(records, total, self._replayed_payload)
+
+    def _replayed_payload(self, record):
+        payload = record.payload
+        if record.milestone_name is not None:
+            payload['issue']['milestone'] = self.milestone_ids[record.milestone_name]
+        if any(Importer._PLACEHOLDER_PREFIX in comment['body'] for comment in payload['comments']):
+            self._note_placeholder()
+        return payload
+
+    def _import(self, issues, total, build_payload):
+        self._note_import_start()
+
+        in_flight = deque()
+        tracker = ImportStatusTracker(self)
+        failures = []
+        self._issue_total = total
+        for count, issue in enumerate(issues):
+            entry = self.journal.get_issue(issue.key) if self.journal else None
+            if entry and entry.state == Journal.IMPORTED:
+                issue.githubid = entry.github_id
+                self._last_github_id = entry.github_id
+                self.metrics.count('issues_skipped')
                 continue
 
             print("Index = ", count)
 
-            if 'milestone_name' in issue:
-                issue['milestone'] = self.project.get_milestones()[
-                    issue['milestone_name']]
-                del issue['milestone_name']
+            if entry and entry.state == Journal.SUBMITTED:
+                print('Resuming pending import of', issue.key)
+                tracker.add({'id': entry.import_id})
+                in_flight.append((issue, entry.import_id))
+                while len(in_flight) >= self.max_in_flight:
+                    self._complete_imports(in_flight, tracker, failures)
+                continue
 
-            self.convert_relationships_to_comments(issue)
+            response = self.submit_issue_with_comments(issue, build_payload(issue))
+            tracker.add(response)
+            in_flight.append((issue, response['id']))
+            while len(in_flight) >= self.max_in_flight:
+                self._complete_imports(in_flight, tracker, failures)
+            if failures:
+                break
 
-            issue_comments = issue['comments']
-            del issue['comments']
-            comments = []
-            for comment in issue_comments:
-                comments.append(
-                    dict((k, self._replace_jira_with_github_id(v)) for k, v in comment.items()))
+        # let the imports already submitted finish so their github ids are known
+        while in_flight:
+            self._complete_imports(in_flight, tracker, failures)
+        self._report_progress(force=True)
 
-            self.import_issue_with_comments(issue, comments)
-            count += 1
+        if failures:
+            raise RuntimeError('Failed to import GitHub issues:\n' + '\n'.join(failures))
 
-    def import_issue_with_comments(self, issue, comments):
+    def build_issue_payload(self, issue):
+        """
+        Builds the Issue Import API payload of an issue:
+        the milestone id is looked up, JIRA issue relationships are converted into comments
+        and references to JIRA issues in comments are replaced.
         """
-        Imports a single issue with its comments into GitHub.
-        Importing via GitHub's normal Issue API quickly triggers anti-abuse rate limits.
-        So their unofficial Issue Import API is used instead:
+        milestone = None
+        if issue.milestone_name is not None:
+            milestone = self.milestone_ids.get(issue.milestone_name)
+
+        self.convert_relationships_to_comments(issue)
+        issue_data = issue.to_json(milestone)
+        if self.resolve_references:
+            issue_data['body'] = self._resolve_body_references(issue_data['body'])
+
+        comments = []
+        for comment in issue.comments:
+            resolved_before = self._resolved_references
+            comment_data = comment.to_json()
+            comment_data['body'] = self._replace_jira_with_github_id(comment_data['body'])
+            if self._resolved_references > resolved_before:
+                # what the post-processing pass would have done to this comment
+                comment_data['body'] = self._replace_user_ids(comment_data['body'])
+            comments.append(comment_data)
+
+        return {'issue': issue_data, 'comments': comments}
+
+    def submit_issue_with_comments(self, issue, payload):
+        """
+        Pushes a single issue with its comments to GitHub without waiting for the import to finish.
+        Importing via GitHub's normal Issue API quickly triggers anti-abuse rate limits,
+        so their unofficial Issue Import API is used instead:
         https://gist.github.com/jonmagic/5282384165e0f86ef105
-        This is a two-step process:
-        First the issue with the comments is pushed to GitHub asynchronously.
-        Then GitHub is pulled in a loop until the issue import is completed.
-        Finally the issue github is noted.    
-        """
-        print('Issue ', issue['key'])
-        jiraKey = issue['key']
-        del issue['key']
-
-        response = self.upload_github_issue(issue, comments)
-        gh_issue_url = self.wait_for_issue_creation(response['id'])['issue_url']
-        gh_issue_id = int(gh_issue_url.split('/')[-1])
-        issue['githubid'] = gh_issue_id
-        # print("\nGithub issue id: ", gh_issue_id)
-        issue['key'] = jiraKey
+        Returns the response describing the pending import.
+        """
+        print('Issue ', issue.key)
+        response = self.upload_github_issue(payload['issue'], payload['comments'])
+        if self.journal:
+            self.journal.issue_submitted(issue.key, response['id'], payload['issue']['updated_at'],
+                                         issue_fingerprint(issue, payload), comment_fingerprints(payload))
+        return response
 
     def upload_github_issue(self, issue, comments):
         """
         Uploads a single issue to GitHub asynchronously with the Issue Import API.
+        An upload that failed on the server or lost its connection may have been queued anyway,
+        it is only sent again when the imports listed since show no new one.
         """
         issue_url = '/import/issues'
         issue_data = {'issue': issue, 'comments': comments}
-        return self.run_api(issue_url, method='POST', payload=issue_data)
+        since = self._timestamp(datetime.now(timezone.utc) - Importer._CLOCK_SKEW)
+        response = self.scheduler.request('POST', self.github_url + issue_url, issue_data,
+                                          recover=lambda error: self._queued_import(since))
+        self._import_ids.add(response.data['id'])
+        return response.data
 
-    def wait_for_issue_creation(self, import_id):
+    def _queued_import(self, since):
         """
-        Check the status of a GitHub issue import.
-        If the status is 'pending', it sleeps, then rechecks until the status is
-        either 'imported' or 'failed'.
+        Returns the import that a failed upload queued after all, None if there is none.
+        Uploads are sent one at a time, so an import created since that neither this run
+        nor the journal knows about can only be the failed upload.
         """
-        while True:  # keep checking until status is something other than 'pending'
-            response = self.run_api('/import/issues/' + str(import_id))
+        known = set(self._import_ids)
+        if self.journal:
+            known.update(entry.import_id for entry in self.journal.get_issues())
+        queued = [response for response in self.run_api('/import/issues', params={'since': since})
+                  if response.get('id') not in known]
+        if not queued:
+            return None
+        response = max(queued, key=lambda response: response['id'])
+        print('The failed upload was queued anyway as import', response['id'])
+        self.metrics.count('imports_recovered')
+        return Response(202, {}, response)
+
+    def _complete_imports(self, in_flight, tracker, failures):
+        """
+        Polls the status of all pending imports at once and notes the github id of every
+        finished import at the head of the queue, waits if the head is still pending.
+        Imports are submitted in issue order and GitHub processes them in that order,
+        so the head of the queue is always the next issue number to be assigned.
+        Failed imports are collected without interrupting the rest of the batch.
+        """
+        tracker.poll()
 
-            status = response['status']
-            if status != 'pending':
+        completed = 0
+        while in_flight:
+            issue, import_id = in_flight[0]
+            response = tracker.pop_result(import_id)
+            if response is None:
                 break
-            else:
-                time.sleep(3)
+            in_flight.popleft()
+            completed += 1
+            try:
+                self._check_import_status(response)
+            except RuntimeError as e:
+                print(issue.key, e)
+                failures.append(issue.key + ': ' + str(e))
+                self.metrics.count('issues_failed')
+                if self.journal:
+                    self.journal.issue_failed(issue.key, import_id)
+                continue
+            self.metrics.count('issues_imported')
+            try:
+                self._record_github_id(issue, response)
+            except RuntimeError as e:
+                # imported and recorded, but no more issues are submitted
+                print(issue.key, e)
+                failures.append(issue.key + ': ' + str(e))
+
+        if completed:
+            self._report_progress()
+        else:
+            tracker.wait()
 
+    def _report_progress(self, force=False):
+        counters = self.metrics.counters
+        done = counters['issues_imported'] + counters['issues_failed'] + counters['issues_skipped']
+        self.metrics.progress(done, self._issue_total, force)
+
+    def _record_github_id(self, issue, response):
+        """
+        Notes the GitHub number of an imported issue, references to it are resolved by it.
+        Raises a RuntimeError once it is recorded if it was numbered out of order.
+        """
+        gh_issue_id = int(response['issue_url'].split('/')[-1])
+        last_github_id = self._last_github_id
+        self._last_github_id = gh_issue_id
+        self._github_ids[issue.key] = gh_issue_id
+        issue.githubid = gh_issue_id
+        if self.journal:
+            self.journal.issue_imported(issue.key, response['id'], gh_issue_id)
+        # print("\nGithub issue id: ", gh_issue_id)
+        if last_github_id is not None and gh_issue_id <= last_github_id:
+            raise RuntimeError('GitHub issue %d was numbered out of order after %d'
+                               % (gh_issue_id, last_github_id))
+
+    def _check_import_status(self, response):
+        status = response['status']
         if status == 'imported':
             print("Imported Issue:", response['issue_url'])
         elif status == 'failed':
@@ -194,85 +483,212 @@ class Importer:
                 "Status check for GitHub issue import returned unexpected status: '{}'"
                 .format(status)
             )
-        return response
 
     def convert_relationships_to_comments(self, issue):
-        duplicates = issue['duplicates']
-        is_duplicated_by = issue['is-duplicated-by']
-        relates_to = issue['is-related-to']
-        depends_on = issue['depends-on']
-        blocks = issue['blocks']
-
-        for duplicate_item in duplicates:
-            issue['comments'].append(
-                {"body": "Duplicates: " + self._replace_jira_with_github_id(duplicate_item)})
-
-        for is_duplicated_by_item in is_duplicated_by:
-            issue['comments'].append(
-                {"body": "Is duplicated by: " + self._replace_jira_with_github_id(is_duplicated_by_item)})
-
-        for relates_to_item in relates_to:
-            issue['comments'].append(
-                {"body": "Is related to: " + self._replace_jira_with_github_id(relates_to_item)})
-
-        for depends_on_item in depends_on:
-            issue['comments'].append(
-                {"body": "Depends on: " + self._replace_jira_with_github_id(depends_on_item)})
-
-        for blocks_item in blocks:
-            issue['comments'].append(
-                {"body": "Blocks: " + self._replace_jira_with_github_id(blocks_item)})
-
-        del issue['duplicates']
-        del issue['is-duplicated-by']
-        del issue['is-related-to']
-        del issue['depends-on']
-        del issue['blocks']
+        """
+        Turns the JIRA issue links into comments, the linked keys are replaced
+        together with the other issue references in the comments.
+        """
+        for link in sorted(issue.links, key=lambda link: Link.KINDS.index(link.kind)):
+            issue.comments.append(Comment(Importer._LINK_COMMENT_PREFIXES[link.kind] + link.key))
+        issue.links = ()
 
     def _replace_jira_with_github_id(self, text):
-        result = text
-        for pattern, replacement in self.jira_issue_replace_patterns.items():
-            result = re.sub(pattern, Importer._PLACEHOLDER_PREFIX +
-                            replacement + Importer._PLACEHOLDER_SUFFIX, result)
-        return result
+        self._prepare_reference_patterns()
+        if self._placeholder_templates is None:
+            return self._reference_rewriter.sub(text)
+        replaced = 0
+        for pattern, template in self._placeholder_templates:
+            text, count = pattern.subn(template, text)
+            replaced += count
+        if replaced:
+            self._note_placeholder()
+        return text
+
+    def _issue_reference_callback(self, replacement):
+        return lambda match, first: self._issue_reference(match, match[first], replacement)
+
+    def _issue_reference(self, match, number, replacement):
+        """
+        Returns the final GitHub reference for a matched JIRA reference if it can be resolved
+        before upload, a placeholder for the post-processing pass otherwise.
+        """
+        if self.resolve_references:
+            github_id = self._github_id_for(self.project.name + '-' + number)
+            if github_id is not None:
+                self._resolved_references += 1
+                return replacement.replace(r'\1', str(github_id))
+            if self._writing_body:
+                # descriptions are not post-processed, whether and as what the issue will be imported is unknown
+                return match[0]
+
+        self._note_placeholder()
+        return (Importer._PLACEHOLDER_PREFIX + replacement.replace(r'\1', number) +
+                Importer._PLACEHOLDER_SUFFIX)
+
+    def _github_id_for(self, jira_key):
+        """
+        Returns the GitHub number a JIRA issue was imported as, None if it is not imported yet.
+        Only the numbers GitHub assigned are used, a failed import shifts the numbers of the
+        issues submitted after it, so they cannot be derived from the keys.
+        """
+        github_id = self._github_ids.get(jira_key)
+        if github_id is None and self.journal:
+            entry = self.journal.get_issue(jira_key)
+            github_id = entry.github_id if entry else None
+        return github_id
+
+    def _note_placeholder(self):
+        if not self._placeholders_written:
+            self._placeholders_written = True
+            if self.journal:
+                self.journal.set_flag('placeholders_written')
+
+    def _resolve_body_references(self, body):
+        """
+        Resolves the JIRA references in an issue description,
+        leaving the link back to the original JIRA issue alone.
+        """
+        description, separator, footer = body.rpartition(Importer._IMPORT_FOOTER)
+        self._writing_body = True
+        try:
+            if not separator:
+                return self._replace_jira_with_github_id(body)
+            return self._replace_jira_with_github_id(description) + separator + footer
+        finally:
+            self._writing_body = False
 
     def post_process_comments(self):
         """
         Starts post-processing all issue comments.
         """
         comment_url = '/issues/comments'
+        if (self.resolve_references and not self._placeholders_written and
+                not (self.journal and self.journal.get_flag('placeholders_written'))):
+            print('All issue references were resolved on upload, no comments to post-process')
+            return
         self._post_process_comments(comment_url)
 
     def _post_process_comments(self, url):
         """
-        Paginates through all issue comments and replaces the issue id placeholders with the correct issue ids.
+        Paginates through the issue comments updated since the import started and replaces
+        the issue id placeholders with the correct issue ids.
+        Comments are patched a few at a time, patched comments are remembered in the journal
+        and a completed pass moves the start of the window forward, so reruns skip finished work.
         """
-        print("listing comments using " + url)
-        comments = self.run_api(url)
-
-        for comment in comments:
+        params = {'sort': 'updated', 'direction': 'asc'}
+        since = self._post_processing_since()
+        if since:
+            params['since'] = since
+        pass_started_at = self._timestamp(datetime.now(timezone.utc) - Importer._CLOCK_SKEW)
+
+        print("listing comments using " + url, 'since ' + since if since else '')
+        # patching moves a comment to the end of the listing sorted by update time,
+        # so the listing is read completely before anything is patched, otherwise pages shift
+        patches = []
+        for comment in self.run_api_pages(url, params):
             # print("handling comment " + comment['url'])
+            if self.journal and self.journal.is_comment_patched(comment['id']):
+                continue
             body = comment['body']
             if Importer._PLACEHOLDER_PREFIX in body:
-                midbody = self._replace_github_id_placholder(body)
-                newbody = self._replace_user_ids(midbody)
-                self._patch_comment(url, comment['id'], newbody)
+                patches.append((comment['id'], comment.get('node_id'), self.final_comment_body(body)))
+
+        if self.graphql:
+            self._patch_comments_batched(patches)
+        else:
+            self._patch_comments(url, patches)
+
+        if self.journal:
+            self.journal.set_flag('comments_post_processed_at', pass_started_at)
+
+    def _patch_comments(self, url, patches):
+        with ThreadPoolExecutor(max_workers=self.max_concurrent_requests) as patcher:
+            pending = set()
+            for comment_id, node_id, newbody in patches:
+                pending.add(patcher.submit(self._patch_comment, url, comment_id, newbody))
+                if len(pending) >= self.max_concurrent_requests:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    self._note_patched_comments(done)
+            self._note_patched_comments(pending)
+
+    def _patch_comments_batched(self, patches):
+        """
+        Patches the comments with batched GraphQL mutations. The comments patched are noted in the journal
+        before the failed ones are reported, so a rerun only retries those.
+        """
+        if not patches:
+            return
+        print('patching %d comments in batches of %d' % (len(patches), self.graphql.batch_size))
+        results = self.graphql.mutate([
+            Operation('updateIssueComment', {'input': ('UpdateIssueCommentInput!', {'id': node_id, 'body': newbody})},
+                      '{ clientMutationId }')
+            for comment_id, node_id, newbody in patches])
+        failures = []
+        patched = []
+        for (comment_id, node_id, newbody), result in zip(patches, results):
+            if isinstance(result, GraphQLError):
+                failures.append('comment %d: %s' % (comment_id, result))
+            else:
+                patched.append(comment_id)
+        self._comments_patched(patched)
+        if failures:
+            raise RuntimeError('Failed to patch comments:\n' + '\n'.join(failures))
+
+    def _post_processing_since(self):
+        if not self.journal:
+            return self._import_started_at
+        return max(filter(None, [self.journal.get_flag('import_started_at'),
+                                 self.journal.get_flag('comments_post_processed_at')]),
+                   default=None)
+
+    def _note_patched_comments(self, futures):
+        self._comments_patched([future.result() for future in futures])
+
+    def _comments_patched(self, comment_ids):
+        self.metrics.count('comments_patched', len(comment_ids))
+        if self.journal and comment_ids:
+            self.journal.comments_patched(comment_ids)
+
+    def _note_import_start(self):
+        self._import_started_at = self._timestamp(datetime.now(timezone.utc) - Importer._CLOCK_SKEW)
+        if self.journal and not self.journal.get_flag('import_started_at'):
+            self.journal.set_flag('import_started_at', self._import_started_at)
+
+    def _timestamp(self, moment):
+        return moment.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    def final_comment_body(self, body):
+        """
+        Returns a comment body the way the post-processing pass leaves it: the issue reference
+        placeholders are replaced with the GitHub issue ids and the JIRA account ids with the user names.
+        """
+        if Importer._PLACEHOLDER_PREFIX not in body:
+            return body
+        return self._replace_user_ids(self._replace_github_id_placholder(body))
 
     def _replace_github_id_placholder(self, text):
-        result = text
-        pattern = Importer._PLACEHOLDER_PREFIX + Importer._GITHUB_ISSUE_PREFIX + \
-                  r'(\d+)' + Importer._PLACEHOLDER_SUFFIX
-        result = re.sub(pattern, Importer._GITHUB_ISSUE_PREFIX + r'\1', result)
-        pattern = Importer._PLACEHOLDER_PREFIX + \
-                  r'(\d+)' + Importer._PLACEHOLDER_SUFFIX
-        result = re.sub(pattern, r'\1', result)
-        return result
+        return Importer._PLACEHOLDER_PATTERN.sub(self._placeholder_reference, text)
+
+    def _placeholder_reference(self, match):
+        """
+        Returns the GitHub reference for a placeholder, the number of an issue that is not
+        imported is kept as it is.
+        """
+        github_id = self._github_id_for(self.project.name + '-' + match[2])
+        return (match[1] or '') + (match[2] if github_id is None else str(github_id))
 
     def _replace_user_ids(self, text):
-        result = text
-        for userid in self.project.users:
-            result = result.replace(userid, self.project.users[userid])
-        return result
+        """
+        Replaces all JIRA account ids in the text with the user names in one pass.
+        The placeholder account id of unassigned issues is left alone.
+        """
+        if self._user_id_count != len(self.project.users):
+            self._user_id_count = len(self.project.users)
+            self._user_id_rewriter = LiteralRewriter(dict(
+                (userid, name) for userid, name in self.project.users.items()
+                if userid and userid != '-1' and name is not None))
+        return self._user_id_rewriter.sub(text)
 
     def _patch_comment(self, url, comment_id, body):
         """
@@ -283,3 +699,4 @@ class Importer:
         patch_data = {'body': body}
         # print(patch_data)
         self.run_api(url + '/' + str(comment_id), method='PATCH', payload=patch_data)
+        return comment_id
@@ -0,0 +1,97 @@
+from scheduler import RequestScheduler
+import time
+
+
+class ImportStatusTracker:
+    """
+    Keeps track of pending GitHub issue imports and checks all of them with one listing call
+    (GET /import/issues?since=...) instead of one status call per import.
+    The time between polls adapts to how long imports have been taking to complete.
+    """
+    _MIN_DELAY = 0.25
+    _MAX_DELAY = 30.0
+    _BACKOFF = 1.5
+    _SMOOTHING = 0.2
+
+    def __init__(self, importer):
+        self._importer = importer
+        self._pending = dict()
+        self._finished = dict()
+        self._average_completion = None
+        self._idle_polls = 0
+
+    def add(self, response):
+        """
+        Starts tracking the import described by the response of the import POST.
+        """
+        self._pending[response['id']] = (time.monotonic(), response.get('created_at'))
+
+    def pop_result(self, import_id):
+        """
+        Returns the final status response of a finished import and forgets it,
+        or None while the import is still pending.
+        """
+        return self._finished.pop(import_id, None)
+
+    def poll(self):
+        """
+        Fetches the status of all pending imports in one go.
+        Imports that have finished, successfully or not, become available through pop_result.
+        """
+        if not self._pending:
+            return
+
+        responses = self._list_imports()
+        listed = set(response.get('id') for response in responses)
+        # anything the listing did not cover is checked on its own
+        responses += [self._importer.run_api('/import/issues/' + str(import_id),
+                                             priority=RequestScheduler.LOW)
+                      for import_id in list(self._pending) if import_id not in listed]
+        now = time.monotonic()
+        completed = 0
+        for response in responses:
+            import_id = response.get('id')
+            if import_id not in self._pending or response['status'] == 'pending':
+                continue
+            if response['status'] == 'imported' and 'issue_url' not in response:
+                response = self._importer.run_api('/import/issues/' + str(import_id),
+                                                  priority=RequestScheduler.LOW)
+            submitted, _ = self._pending.pop(import_id)
+            self._observe_completion(now - submitted)
+            self._importer.metrics.record_queue_time(now - submitted)
+            self._finished[import_id] = response
+            completed += 1
+
+        self._idle_polls = 0 if completed else self._idle_polls + 1
+
+    def wait(self):
+        """
+        Sleeps until the oldest pending import can be expected to have finished.
+        Every poll that finds nothing new stretches the delay further.
+        """
+        time.sleep(self.next_delay())
+
+    def next_delay(self):
+        if self._average_completion is None or not self._pending:
+            expected = 1.0
+        else:
+            oldest = min(submitted for submitted, _ in self._pending.values())
+            expected = self._average_completion - (time.monotonic() - oldest)
+        delay = max(expected, self._MIN_DELAY) * self._BACKOFF ** self._idle_polls
+        return min(delay, self._MAX_DELAY)
+
+    def _list_imports(self):
+        since = min((created for _, created in self._pending.values() if created), default=None)
+        if since is not None and len(self._pending) > 1:
+            try:
+                return list(self._importer.run_api('/import/issues', params={'since': since},
+                                                   priority=RequestScheduler.LOW))
+            except RuntimeError as e:
+                print('Listing imports failed, checking them one by one:', e)
+        return []
+
+    def _observe_completion(self, duration):
+        if self._average_completion is None:
+            self._average_completion = duration
+        else:
+            self._average_completion += self._SMOOTHING * (duration - self._average_completion)
@@ -0,0 +1,104 @@
+from collections import namedtuple
+import sqlite3
+
+JournalEntry = namedtuple("JournalEntry", "key state import_id github_id updated_at fingerprint",
+                          defaults=(None, None))
+
+
+class Journal:
+    """
+    On-disk record of the import progress, keyed by JIRA issue key.
+    Every state change is committed right away (SQLite in WAL mode), so an interrupted
+    import can be resumed without losing the JIRA to GitHub issue mapping.
+    The JIRA update time and content fingerprints of what was sent for every issue and
+    comment are kept as well, for incremental syncs of later exports.
+    """
+    SUBMITTED = 'submitted'
+    IMPORTED = 'imported'
+    FAILED = 'failed'
+
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS issues ('
+                         'key TEXT PRIMARY KEY, state TEXT NOT NULL, '
+                         'import_id INTEGER, github_id INTEGER)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS flags ('
+                         'name TEXT PRIMARY KEY, value TEXT)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS patched_comments ('
+                         'comment_id INTEGER PRIMARY KEY)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS comments ('
+                         'key TEXT NOT NULL, position INTEGER NOT NULL, fingerprint TEXT, '
+                         'PRIMARY KEY (key, position))')
+        # journals written before fingerprints were kept lack these columns
+        columns = set(row[1] for row in self._db.execute('PRAGMA table_info(issues)'))
+        for column in ('updated_at', 'fingerprint'):
+            if column not in columns:
+                self._db.execute('ALTER TABLE issues ADD COLUMN %s TEXT' % column)
+        self._db.commit()
+        self._issues = dict((row[0], JournalEntry(*row)) for row in
+                            self._db.execute('SELECT key, state, import_id, github_id, updated_at, fingerprint '
+                                             'FROM issues'))
+        self._patched_comments = set(row[0] for row in
+                                     self._db.execute('SELECT comment_id FROM patched_comments'))
+
+    def get_issue(self, key):
+        return self._issues.get(key)
+
+    def get_issues(self):
+        return self._issues.values()
+
+    def issue_submitted(self, key, import_id, updated_at=None, fingerprint=None, comment_fingerprints=None):
+        self._save(JournalEntry(key, Journal.SUBMITTED, import_id, None, updated_at, fingerprint),
+                   comment_fingerprints)
+
+    def issue_imported(self, key, import_id, github_id):
+        previous = self._issues.get(key) or JournalEntry(key, None, None, None)
+        self._save(previous._replace(state=Journal.IMPORTED, import_id=import_id, github_id=github_id))
+
+    def issue_failed(self, key, import_id):
+        self._save(JournalEntry(key, Journal.FAILED, import_id, None))
+
+    def issue_synced(self, key, updated_at, fingerprint, comment_fingerprints):
+        """
+        Notes the state of an imported issue that was brought up to date with a later export.
+        """
+        self._save(self._issues[key]._replace(updated_at=updated_at, fingerprint=fingerprint),
+                   comment_fingerprints)
+
+    def get_comment_fingerprints(self, key):
+        return [row[0] for row in self._db.execute(
+            'SELECT fingerprint FROM comments WHERE key = ? ORDER BY position', (key,))]
+
+    def is_comment_patched(self, comment_id):
+        return comment_id in self._patched_comments
+
+    def comments_patched(self, comment_ids):
+        self._db.executemany('INSERT OR IGNORE INTO patched_comments (comment_id) VALUES (?)',
+                             [(comment_id,) for comment_id in comment_ids])
+        self._db.commit()
+        self._patched_comments.update(comment_ids)
+
+    def get_flag(self, name):
+        row = self._db.execute('SELECT value FROM flags WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_flag(self, name, value='1'):
+        self._db.execute('INSERT OR REPLACE INTO flags (name, value) VALUES (?, ?)', (name, value))
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def _save(self, entry, comment_fingerprints=None):
+        self._db.execute('INSERT OR REPLACE INTO issues (key, state, import_id, github_id, updated_at, fingerprint) '
+                         'VALUES (?, ?, ?, ?, ?, ?)', entry)
+        if comment_fingerprints is not None:
+            self._db.execute('DELETE FROM comments WHERE key = ?', (entry.key,))
+            self._db.executemany('INSERT INTO comments (key, position, fingerprint) VALUES (?, ?, ?)',
+                                 [(entry.key, position, fingerprint)
+                                  for position, fingerprint in enumerate(comment_fingerprints)])
+        self._db.commit()
+        self._issues[entry.key] = entry
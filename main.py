@@ -1,57 +1,265 @@
+import argparse
+import base64
 import getpass
+import os
 from collections import namedtuple
-import sys
-from lxml import objectify
+from attachments import AttachmentMirror
 from project import Project
 from importer import Importer
+from journal import Journal
+from graphqlbatch import GraphQLBatcher
 from labelcolourselector import LabelColourSelector
+from metrics import Metrics
+from parsecache import ParseCache
+from payloadfile import iter_payloads, read_header, write_payloads
+from pipeline import ProjectStream
+from responsecache import ResponseCache
+from scheduler import RequestScheduler
+from transport import GhCliTransport, HttpTransport
+from xmlreader import parse_files
 
 
-def read_xml_sourcefile(file_names):
-    files = list()
-    for file_name in file_names:
-        all_text = open(file_name).read()
-        files.append(objectify.fromstring(all_text))
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Imports JIRA XML exports into a GitHub repository.')
+    parser.add_argument('file_names', nargs='*', metavar='jira-export.xml',
+                        help='JIRA XML export files, in issue key order')
+    parser.add_argument('--transform-to', default=None, metavar='payloads.ndjson.gz',
+                        help='only build the import payloads of all issues and write them to this file, '
+                             'nothing is sent to GitHub')
+    parser.add_argument('--replay', default=None, metavar='payloads.ndjson.gz',
+                        help='import the payloads of a file written by --transform-to instead of '
+                             'parsing exports')
+    parser.add_argument('--transport', choices=('http', 'gh'), default='http',
+                        help='talk to GitHub in-process over pooled HTTP connections (default) '
+                             'or through one `gh api` call per request')
+    parser.add_argument('--api-url', default=None,
+                        help='GitHub API base URL for the http transport, e.g. a local test server')
+    parser.add_argument('--in-flight', type=int, default=Importer._DEFAULT_MAX_IN_FLIGHT,
+                        help='number of issue imports kept pending on GitHub at the same time')
+    parser.add_argument('--journal', default=None,
+                        help='progress journal used to resume an interrupted import '
+                             '(default: <account>-<repo>.journal.sqlite)')
+    parser.add_argument('--resolve-references', action='store_true',
+                        help='write the final GitHub references to issues imported already on upload '
+                             'instead of placeholders that are patched afterwards')
+    parser.add_argument('--delta', action='store_true',
+                        help='sync a later export into a repository imported before with the same journal: '
+                             'new issues are imported, changed issues and comments are updated')
+    parser.add_argument('--fill-gaps', action='store_true',
+                        help='import a closed placeholder issue for every key missing from the exports, '
+                             'so that JIRA-n still becomes GH-n')
+    parser.add_argument('--first-key', type=int, default=1, metavar='N',
+                        help='with --fill-gaps, the key number the placeholders start at, the next issue number '
+                             'of the repository, e.g. when importing a later key range (default: 1)')
+    parser.add_argument('--stream', action='store_true',
+                        help='start importing while the exports are still parsed, milestones and labels '
+                             'are created when first used, the exports have to be in key order without overlaps')
+    parser.add_argument('--mirror-attachments', default=None, metavar='DIRECTORY',
+                        help='download the images and attachments the issues refer to into this '
+                             'content-addressed store and link to their copies below --mirror-url')
+    parser.add_argument('--mirror-url', default=None,
+                        help='base URL the attachment store is published at')
+    parser.add_argument('--jira-url', default=None,
+                        help='fetch the attachments from this JIRA base URL instead of the one in the exports')
+    parser.add_argument('--attachment-workers', type=int, default=AttachmentMirror._DEFAULT_MAX_WORKERS,
+                        help='number of attachments downloaded at the same time')
+    parser.add_argument('--cache-dir', default='.jira-import-cache',
+                        help='directory of the parse cache, reruns on unchanged exports load the parsed '
+                             'project from there instead of reading the XML again')
+    parser.add_argument('--no-cache', action='store_true', help='always parse the exports')
+    parser.add_argument('--http-cache-size', type=int, default=ResponseCache._DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help='megabytes of GitHub GET responses kept in the cache directory, they are '
+                             'revalidated with conditional requests that do not count against the rate limit '
+                             '(0 disables the cache)')
+    parser.add_argument('--writes-per-minute', type=int, default=RequestScheduler._DEFAULT_WRITES_PER_MINUTE,
+                        help='cap on content-creating requests per minute, GitHub asks for at most 80 '
+                             '(0 disables the cap)')
+    parser.add_argument('--graphql-batch-size', type=int, default=0,
+                        help='create labels and patch comments with batched GraphQL requests of this many '
+                             'operations each instead of one REST call apiece (default: 0, REST only)')
+    parser.add_argument('--metrics-json', default=None,
+                        help='write phase timings and API call metrics as JSON to this file')
+    parser.add_argument('--metrics-prom', default=None,
+                        help='write the metrics in the Prometheus text format to this file, '
+                             'e.g. for the node exporter textfile collector')
+    args = parser.parse_args()
+    if bool(args.file_names) == bool(args.replay):
+        parser.error('give either export files or --replay')
+    if args.replay and args.transform_to:
+        parser.error('--transform-to needs export files')
+    if args.stream and (args.replay or args.transform_to):
+        parser.error('--stream imports export files directly')
+    if args.delta and (args.stream or args.replay or args.transform_to):
+        parser.error('--delta works on export files only')
+    if args.mirror_attachments and not args.mirror_url:
+        parser.error('--mirror-attachments needs --mirror-url')
+    if args.mirror_attachments and (args.stream or args.replay):
+        parser.error('--mirror-attachments needs all issues parsed before the import, '
+                     'it does not work with --stream or --replay')
+    if args.first_key < 1:
+        parser.error('--first-key must be at least 1')
+    if args.stream and args.fill_gaps:
+        parser.error('--fill-gaps needs all issues before the import starts, it does not work with --stream')
+    return args
 
-    return files
 
+def read_default_labels():
+    return list(filter(None,
+            [l.strip()
+                for l in input('Default labels to apply (comma-separated): ').split(',')]))
 
-file_names = sys.argv[1::]
-all_xml_files = read_xml_sourcefile(file_names)
 
-us = input('GitHub account name: ')
-repo = input('GitHub project name: ')
-default_labels = list(filter(None,
-        [l.strip()
-            for l in input('Default labels to apply (comma-separated): ').split(',')]))
+def create_transport(args):
+    if args.transport == 'gh':
+        return GhCliTransport()
+    return HttpTransport.from_gh(args.api_url)
 
-Options = namedtuple("Options", "account repo")
-opts = Options(account=us, repo=repo)
 
-project = Project(default_labels)
+def create_graphql(args, scheduler):
+    if not args.graphql_batch_size:
+        return None
+    url = '/graphql'
+    api_url = (args.api_url or '').rstrip('/')
+    if api_url.endswith('/api/v3'):
+        # GitHub Enterprise Server serves GraphQL next to the REST API instead of below it
+        url = api_url[:-len('/v3')] + '/graphql'
+    return GraphQLBatcher(scheduler, url, args.graphql_batch_size)
 
-for f in all_xml_files:
-    for item in f.channel.item:
-        project.add_item(item)
 
-project.prettify()
+def load_project(args, default_labels):
+    """
+    Parses the export files, or loads the project from the parse cache when they did not change.
+    """
+    if args.no_cache:
+        # every export file is parsed in its own worker process
+        project = parse_files(args.file_names, default_labels)
+    else:
+        cache = ParseCache(args.cache_dir)
+        key = cache.key(args.file_names, default_labels)
+        project = cache.load(key)
+        if project is not None:
+            print('Loaded the parsed exports from the cache')
+        else:
+            project = parse_files(args.file_names, default_labels)
+            cache.store(key, project)
+    if args.fill_gaps:
+        project.order_issues(fill_gaps=True, first_key=args.first_key)
+    return project
 
-start_from_issue = input('Start from [0 = beginning]: ') or 0
 
-'''
-Steps:
-  1. Create any milestones
-  2. Create any labels
-  3. Create each issue with comments, linking them to milestones and labels
-  4: Post-process all comments to replace issue id placeholders with the real ones
-'''
-importer = Importer(opts, project)
-colourSelector = LabelColourSelector(project)
+def mirror_attachments(args, project, metrics=None):
+    """
+    Copies the attachments into the store and points the issues at the copies.
+    JIRA_USER and JIRA_TOKEN are sent as basic authentication if set.
+    """
+    headers = dict()
+    if os.environ.get('JIRA_USER') and os.environ.get('JIRA_TOKEN'):
+        credentials = os.environ['JIRA_USER'] + ':' + os.environ['JIRA_TOKEN']
+        headers['Authorization'] = 'Basic ' + base64.b64encode(credentials.encode()).decode()
+    mirror = AttachmentMirror(args.mirror_attachments, args.mirror_url, args.attachment_workers,
+                              args.jira_url, headers, metrics=metrics)
+    count = mirror.mirror(project)
+    print('%d attachments link to the mirror' % count)
 
-importer.import_milestones()
 
-if int(start_from_issue) == 0:
-    importer.import_labels(colourSelector)
+def transform(args):
+    """
+    Writes the import payloads of all issues to a file, to be imported later with --replay.
+    """
+    default_labels = read_default_labels()
+    project = load_project(args, default_labels)
+    if args.mirror_attachments:
+        mirror_attachments(args, project)
+    project.prettify()
+    Options = namedtuple("Options", "account repo")
+    importer = Importer(Options(account=None, repo=None), project, resolve_references=args.resolve_references)
+    count = write_payloads(importer, args.transform_to)
+    print('Wrote the payloads of %d issues to %s' % (count, args.transform_to))
 
-importer.import_issues(int(start_from_issue))
-importer.post_process_comments()
+
+def main():
+    args = parse_arguments()
+    if args.transform_to:
+        transform(args)
+        return
+
+    us = input('GitHub account name: ')
+    repo = input('GitHub project name: ')
+
+    Options = namedtuple("Options", "account repo")
+    opts = Options(account=us, repo=repo)
+
+    metrics = Metrics()
+
+    if args.replay:
+        # the default labels and the reference handling were decided when the payloads were built
+        header = read_header(args.replay)
+        project = Project.from_summary(header['project'])
+        args.resolve_references = header['resolve_references']
+        project.prettify()
+        print('Payloads to import: %d' % header['issues'])
+    elif args.stream:
+        default_labels = read_default_labels()
+        # filled batch by batch during the import
+        project = Project(default_labels)
+    else:
+        default_labels = read_default_labels()
+        with metrics.phase('parse'):
+            project = load_project(args, default_labels)
+        if args.mirror_attachments:
+            with metrics.phase('attachments'):
+                mirror_attachments(args, project, metrics)
+        project.prettify()
+
+    # issues already imported by an earlier run are skipped based on the journal
+    journal = Journal(args.journal or '%s-%s.journal.sqlite' % (us, repo))
+
+    '''
+    Steps:
+      1. Create any milestones
+      2. Create any labels
+      3. Create each issue with comments, linking them to milestones and labels
+      4: Post-process all comments to replace issue id placeholders with the real ones
+    '''
+    transport = create_transport(args)
+    response_cache = None
+    if args.http_cache_size > 0:
+        response_cache = ResponseCache(os.path.join(args.cache_dir, 'responses.sqlite'),
+                                       args.http_cache_size * 1024 * 1024,
+                                       '%s %s' % (args.transport, args.api_url or ''))
+    scheduler = RequestScheduler(transport, metrics, args.writes_per_minute, cache=response_cache)
+    importer = Importer(opts, project, transport, args.in_flight, journal,
+                        args.resolve_references, metrics, scheduler, create_graphql(args, scheduler))
+    colourSelector = LabelColourSelector(project)
+
+    try:
+        if args.stream:
+            with metrics.phase('parse and issues'):
+                importer.import_stream(ProjectStream(args.file_names, default_labels), colourSelector)
+        else:
+            with metrics.phase('milestones'):
+                importer.import_milestones()
+            with metrics.phase('labels'):
+                importer.import_labels(colourSelector, recheck=args.delta)
+            with metrics.phase('issues'):
+                if args.delta:
+                    importer.sync_issues()
+                elif args.replay:
+                    importer.replay_issues(iter_payloads(args.replay), header['issues'])
+                else:
+                    importer.import_issues()
+        with metrics.phase('post-process'):
+            importer.post_process_comments()
+    finally:
+        journal.close()
+        if response_cache:
+            response_cache.close()
+        # written even when the import failed, that is when the numbers are most interesting
+        if args.metrics_json:
+            metrics.write_json(args.metrics_json)
+        if args.metrics_prom:
+            metrics.write_prometheus(args.metrics_prom)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import timedelta
+import bisect
+import json
+import os
+import re
+import threading
+import time
+
+_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+_QUEUE_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+_NUMBER_SEGMENT = re.compile(r'/\d+(?=/|$)')
+_PREFIX = 'jira_importer_'
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_json(self):
+        return {'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], self._cumulative())),
+                'sum': self.sum, 'count': self.count}
+
+    def _cumulative(self):
+        total = 0
+        for count in self.counts:
+            total += count
+            yield total
+
+
+class Metrics:
+    """
+    Collects timings of the import phases, per endpoint API call counts and latencies,
+    retries and the time issue imports spend in GitHub's queue.
+    Prints a throughput/ETA line while issues are imported and writes a summary
+    as JSON and as a Prometheus textfile at the end. Safe to use from several threads.
+    """
+    _PROGRESS_INTERVAL = 10.0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self.phases = dict()
+        self.calls = defaultdict(int)
+        self.latencies = dict()
+        self.retries = defaultdict(int)
+        self.queue_times = Histogram(_QUEUE_BUCKETS)
+        self.counters = defaultdict(int)
+        self._progress_started = None
+        self._last_progress = 0.0
+        self._last_done = None
+
+    @contextmanager
+    def phase(self, name):
+        started = time.monotonic()
+        print('== %s' % name)
+        try:
+            yield
+        finally:
+            duration = time.monotonic() - started
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + duration
+            print('== %s took %s' % (name, timedelta(seconds=round(duration))))
+
+    def record_call(self, method, url, duration, status):
+        endpoint = self.endpoint(url)
+        with self._lock:
+            self.calls[(method, endpoint, str(status))] += 1
+            histogram = self.latencies.get((method, endpoint))
+            if histogram is None:
+                histogram = self.latencies[(method, endpoint)] = Histogram(_LATENCY_BUCKETS)
+            histogram.observe(duration)
+
+    def record_retry(self, method, url, reason):
+        with self._lock:
+            self.retries[(method, self.endpoint(url), str(reason))] += 1
+
+    def record_queue_time(self, duration):
+        with self._lock:
+            self.queue_times.observe(duration)
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def progress(self, done, total, force=False):
+        """
+        Prints the import throughput and the estimated time left, at most every few seconds.
+        """
+        now = time.monotonic()
+        if self._progress_started is None:
+            self._progress_started = (now, done)
+            return
+        if done == self._last_done or (not force and now - self._last_progress < self._PROGRESS_INTERVAL):
+            return
+        self._last_progress = now
+        self._last_done = done
+        started, done_at_start = self._progress_started
+        rate = (done - done_at_start) / max(now - started, 1e-9)
+        if total is None:
+            # the total is not known while the exports are still streamed in
+            print('Progress: %d issues, %.2f issues/s' % (done, rate))
+            return
+        eta = timedelta(seconds=round((total - done) / rate)) if rate > 0 else 'unknown'
+        print('Progress: %d/%d issues, %.2f issues/s, ETA %s' % (done, total, rate, eta))
+
+    def endpoint(self, url):
+        """
+        Reduces a request URL to its endpoint, e.g. /repos/o/r/import/issues/12 to /import/issues/{id}.
+        """
+        path = url.split('://', 1)[-1]
+        if '://' in url:
+            path = '/' + path.split('/', 1)[-1]
+        path = path.split('?', 1)[0]
+        path = re.sub(r'^(/repositories/\d+|/repos/[^/]+/[^/]+)', '', path)
+        return _NUMBER_SEGMENT.sub('/{id}', path) or '/'
+
+    def to_json(self):
+        with self._lock:
+            return {'elapsed_seconds': time.monotonic() - self._started,
+                    'phases': dict(self.phases),
+                    'counters': dict(self.counters),
+                    'api_calls': [{'method': m, 'endpoint': e, 'status': s, 'count': c}
+                                  for (m, e, s), c in sorted(self.calls.items())],
+                    'api_latency_seconds': [dict(method=m, endpoint=e, **h.to_json())
+                                            for (m, e), h in sorted(self.latencies.items())],
+                    'retries': [{'method': m, 'endpoint': e, 'reason': r, 'count': c}
+                                for (m, e, r), c in sorted(self.retries.items())],
+                    'import_queue_seconds': self.queue_times.to_json()}
+
+    def write_json(self, path):
+        self._write(path, json.dumps(self.to_json(), indent=2) + '\n')
+
+    def write_prometheus(self, path):
+        """
+        Writes the metrics in the Prometheus text format, e.g. for the node exporter textfile collector.
+        """
+        summary = self.to_json()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append('# HELP %s%s %s' % (_PREFIX, name, help_text))
+            lines.append('# TYPE %s%s %s' % (_PREFIX, name, kind))
+            for suffix, labels, value in samples:
+                label_text = ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                                      for k, v in labels.items())
+                lines.append('%s%s%s%s %s' % (_PREFIX, name, suffix,
+                                              '{' + label_text + '}' if label_text else '', repr(float(value))))
+
+        def histogram_samples(labels, histogram):
+            for le, count in histogram['buckets'].items():
+                yield '_bucket', dict(labels, le=le), count
+            yield '_sum', labels, histogram['sum']
+            yield '_count', labels, histogram['count']
+
+        metric('run_duration_seconds', 'gauge', 'Wall time of the import run.',
+               [('', {}, summary['elapsed_seconds'])])
+        metric('phase_duration_seconds', 'gauge', 'Wall time per import phase.',
+               [('', {'phase': name}, value) for name, value in summary['phases'].items()])
+        metric('events_total', 'counter', 'Counted import events.',
+               [('', {'event': name}, value) for name, value in summary['counters'].items()])
+        metric('api_requests_total', 'counter', 'GitHub API requests by endpoint and status.',
+               [('', {'method': c['method'], 'endpoint': c['endpoint'], 'status': c['status']}, c['count'])
+                for c in summary['api_calls']])
+        metric('api_request_duration_seconds', 'histogram', 'GitHub API request latency.',
+               [sample for h in summary['api_latency_seconds']
+                for sample in histogram_samples({'method': h['method'], 'endpoint': h['endpoint']}, h)])
+        metric('api_retries_total', 'counter', 'Retried GitHub API requests.',
+               [('', {'method': r['method'], 'endpoint': r['endpoint'], 'reason': r['reason']}, r['count'])
+                for r in summary['retries']])
+        metric('import_queue_seconds', 'histogram', 'Time issue imports spent pending on GitHub.',
+               list(histogram_samples({}, summary['import_queue_seconds'])))
+        self._write(path, '\n'.join(lines) + '\n')
+
+    def _write(self, path, text):
+        # written under a temporary name first, so readers never see half a file
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as out:
+            out.write(text)
+        os.replace(temporary, path)
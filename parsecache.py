@@ -0,0 +1,98 @@
+from project import Project
+import hashlib
+import os
+import pickle
+import project
+import records
+import timestamps
+import xmlreader
+
+_CHUNK_SIZE = 1024 * 1024
+# the modules whose code decides what a parsed project looks like
+_PARSER_MODULES = (project, records, timestamps, xmlreader)
+
+
+class ParseCache:
+    """
+    Keeps fully built projects on disk, keyed by the content of the export files,
+    the default labels and the parser code, so reruns skip reading and transforming the XML.
+    Any change to one of these gives a new key, entries that are no longer used
+    are dropped once more than max_entries exist.
+    An entry is a pickled header followed by the issues in chunks, which are unpickled
+    one after another while the file is read.
+    """
+    _VERSION = 1
+    _ISSUES_PER_CHUNK = 2000
+    _SUFFIX = '.project.pickle'
+
+    def __init__(self, directory, max_entries=4):
+        self.directory = directory
+        self.max_entries = max_entries
+
+    def key(self, file_names, default_labels):
+        digest = hashlib.sha256()
+        digest.update(b'parse cache %d\n' % ParseCache._VERSION)
+        for module in _PARSER_MODULES:
+            with open(module.__file__, 'rb') as source:
+                digest.update(hashlib.sha256(source.read()).digest())
+        digest.update(repr(list(default_labels)).encode() + b'\n')
+        for file_name in file_names:
+            digest.update(self._file_digest(file_name))
+        return digest.hexdigest()
+
+    def load(self, key):
+        """
+        Returns the cached project for the key, None when there is none.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as source:
+                state = pickle.load(source)
+                loaded = Project.__new__(Project)
+                loaded.__dict__.update(state['project'])
+                issues = loaded.get_issues()
+                while len(issues) < state['issues']:
+                    issues.extend(pickle.load(source))
+                loaded._reindex_issues()
+        except FileNotFoundError:
+            return None
+        except (EOFError, pickle.UnpicklingError, AttributeError, KeyError, ValueError) as e:
+            print('Ignoring unreadable parse cache entry', path + ':', repr(e))
+            os.remove(path)
+            return None
+        # keeps the entry from being pruned
+        os.utime(path)
+        return loaded
+
+    def store(self, key, parsed):
+        os.makedirs(self.directory, exist_ok=True)
+        issues = parsed.get_issues()
+        state = dict(parsed.__dict__)
+        # the issues are stored in chunks, the index over them is rebuilt on loading
+        del state['_issue_index']
+        state['_project'] = dict(state['_project'], Issues=[])
+        path = self._path(key)
+        temporary = '%s.%d.tmp' % (path, os.getpid())
+        with open(temporary, 'wb') as out:
+            pickle.dump({'project': state, 'issues': len(issues)}, out, pickle.HIGHEST_PROTOCOL)
+            for start in range(0, len(issues), ParseCache._ISSUES_PER_CHUNK):
+                pickle.dump(issues[start:start + ParseCache._ISSUES_PER_CHUNK], out, pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+        self._prune()
+
+    def _prune(self):
+        entries = [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                   if name.endswith(ParseCache._SUFFIX)]
+        entries.sort(key=os.path.getmtime, reverse=True)
+        for path in entries[self.max_entries:]:
+            os.remove(path)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ParseCache._SUFFIX)
+
+    def _file_digest(self, file_name):
+        digest = hashlib.sha256()
+        with open(file_name, 'rb') as source:
+            for chunk in iter(lambda: source.read(_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest.digest()
@@ -0,0 +1,70 @@
+import gzip
+import json
+
+_FORMAT = 'jira-issues-importer payloads'
+_VERSION = 1
+
+
+class PayloadRecord:
+    """
+    The Issue Import API payload of one issue as stored in a payload file.
+    The milestone is kept by name, its GitHub id is only known when the payload is uploaded.
+    """
+    __slots__ = ('key', 'milestone_name', 'payload', 'githubid')
+
+    def __init__(self, key, milestone_name, payload):
+        self.key = key
+        self.milestone_name = milestone_name
+        self.payload = payload
+        self.githubid = None
+
+
+def write_payloads(importer, file_name):
+    """
+    Builds the payloads of all issues of the importer's project and writes them to a gzip
+    compressed NDJSON file, one issue per line after a header line with the project summary.
+    Every line is written as soon as it is built.
+    Returns the number of payloads written.
+    """
+    issues = importer.project.get_issues()
+    with gzip.open(file_name, 'wt', encoding='utf-8') as out:
+        _write_line(out, {'format': _FORMAT, 'version': _VERSION, 'issues': len(issues),
+                          'resolve_references': importer.resolve_references,
+                          'project': importer.project.to_summary()})
+        for issue in issues:
+            # no milestone ids are known yet, the payload carries the milestone by name until the replay
+            payload = importer.build_issue_payload(issue)
+            _write_line(out, {'key': issue.key, 'milestone': issue.milestone_name,
+                              'issue': payload['issue'], 'comments': payload['comments']})
+    return len(issues)
+
+
+def read_header(file_name):
+    """
+    Returns the header of a payload file.
+    """
+    with gzip.open(file_name, 'rt', encoding='utf-8') as source:
+        header = json.loads(source.readline())
+    if header.get('format') != _FORMAT:
+        raise RuntimeError(file_name + ' is not a payload file')
+    if header.get('version') != _VERSION:
+        raise RuntimeError('Unsupported payload file version %r in %s' % (header.get('version'), file_name))
+    return header
+
+
+def iter_payloads(file_name):
+    """
+    Streams the PayloadRecords of a payload file one at a time.
+    """
+    read_header(file_name)
+    with gzip.open(file_name, 'rt', encoding='utf-8') as source:
+        source.readline()
+        for line in source:
+            record = json.loads(line)
+            yield PayloadRecord(record['key'], record['milestone'],
+                                {'issue': record['issue'], 'comments': record['comments']})
+
+
+def _write_line(out, data):
+    out.write(json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+    out.write('\n')
@@ -0,0 +1,81 @@
+from project import Project
+from xmlreader import iter_items
+import queue
+import threading
+
+
+class ProjectStream:
+    """
+    Parses the export files on a background thread and hands out the result in small
+    partial projects through a bounded queue, so the import can start while parsing goes on.
+    At most depth partial projects of batch_size issues each wait in the queue,
+    parsing pauses while the queue is full.
+    """
+    _DEFAULT_BATCH_SIZE = 20
+    _DEFAULT_DEPTH = 10
+    _DONE = object()
+
+    def __init__(self, file_names, default_labels=[], batch_size=_DEFAULT_BATCH_SIZE, depth=_DEFAULT_DEPTH):
+        self.file_names = file_names
+        self.default_labels = default_labels
+        self.batch_size = max(1, batch_size)
+        self._queue = queue.Queue(maxsize=max(1, depth))
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+
+    def __iter__(self):
+        """
+        Yields the partial projects in export order, to be merged one after another.
+        Errors of the parser are raised here.
+        """
+        self._thread.start()
+        try:
+            while True:
+                batch = self._queue.get()
+                if batch is ProjectStream._DONE:
+                    return
+                if isinstance(batch, BaseException):
+                    raise batch
+                yield batch
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Stops parsing, e.g. when the import failed.
+        """
+        self._stopped.set()
+
+    def _produce(self):
+        try:
+            batch = Project(self.default_labels)
+            for file_name in self.file_names:
+                for item in iter_items(file_name):
+                    batch.add_item(item)
+                    if len(batch.get_issues()) >= self.batch_size:
+                        self._put(batch)
+                        batch = Project(self.default_labels)
+            if batch.get_issues():
+                self._put(batch)
+            self._put(ProjectStream._DONE)
+        except _Stopped:
+            pass
+        except Exception as e:
+            try:
+                self._put(e)
+            except _Stopped:
+                pass
+
+    def _put(self, batch):
+        while True:
+            if self._stopped.is_set():
+                raise _Stopped()
+            try:
+                self._queue.put(batch, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+
+class _Stopped(Exception):
+    pass
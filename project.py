@@ -1,16 +1,58 @@
 from collections import defaultdict
+from datetime import datetime, timezone
 from html.entities import name2codepoint
-from dateutil.parser import parse
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlsplit
+from records import Comment, Issue, Link
+from timestamps import to_iso
 import os
 import re
 
+# the tokens of a JIRA description or comment rewritten by Project._rewrite_body
+_BODY_TOKEN = re.compile(r'(?P<spaces> {8})'
+                         r'|&(?P<entity>[A-Za-z][A-Za-z0-9]*);'
+                         r'|<img (?P<img>[^>]*)>'
+                         r'|<a (?P<anchor>[^>]*)>(?:(?P<anchor_text>[^<]*)</a>)?')
+_ENTITY = re.compile(r'(?P<spaces> {8})|&(?P<entity>[A-Za-z][A-Za-z0-9]*);')
+_SRC_ATTRIBUTE = re.compile(r'\bsrc="([^"]*)"')
+_ALT_ATTRIBUTE = re.compile(r'\balt="([^"]*)"')
+_HREF_ATTRIBUTE = re.compile(r'(?<![\w-])href="([^"]*)"')
+_ACCOUNTID_ATTRIBUTE = re.compile(r'\baccountid="([^"]*)"')
+# links to these paths are attachments on the JIRA server
+_ATTACHMENT_PATH = re.compile(r'/secure/(?:attachment|thumbnail)/|/attachment/content/')
+
+
+def _decode_entity(m):
+    if m['spaces']:
+        return ''
+    codepoint = name2codepoint.get(m['entity'])
+    return chr(codepoint) if codepoint is not None else m[0]
+
+
+def _decode_text(text):
+    return _ENTITY.sub(_decode_entity, text)
+
+
+def _key_number(key):
+    return int(key.rsplit('-', 1)[-1])
+
+
+def _moment(timestamp):
+    moment = datetime.fromisoformat(timestamp)
+    # timestamps without an offset come out of the dateutil fallback naive, they are taken as UTC
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+
 class Project:
 
     def __init__(self, default_labels=[]):
         self.name = ''
         self.users = dict()
         self._default_labels = default_labels
+        self._unresolved_users = set()
+        # the URLs of all images and attachments the bodies refer to, in order of appearance
+        self._attachments = dict()
+        # the positions of the issues in the issue list by the number of their key
+        self._issue_index = dict()
         self._project = {'Milestones': defaultdict(int), 'Components': defaultdict(
             int), 'Labels': defaultdict(int), 'Types': defaultdict(int), 'Issues': []}
 
@@ -23,6 +65,18 @@ class Project:
     def get_issues(self):
         return self._project['Issues']
 
+    def take_issues(self):
+        """
+        Removes all issues from the project and returns them.
+        """
+        issues = list(self._project['Issues'])
+        self._project['Issues'].clear()
+        self._issue_index.clear()
+        return issues
+
+    def get_attachments(self):
+        return list(self._attachments)
+
     def get_types(self):
         return self._project['Types']
 
@@ -45,6 +99,134 @@ class Project:
 
         self._add_relationships(item)
 
+        self._index_issue(self._project['Issues'].pop())
+
+    def merge(self, other):
+        """
+        Appends a partial project built from a later export file.
+        Issues keep their order, an issue exported more than once is only kept in the version
+        updated last, histograms are summed and comment authors that were
+        unknown in the partial project are resolved against the users seen so far,
+        so merging partial projects in file order gives the same result as adding
+        every item to a single project.
+        """
+        if other.name:
+            self.name = other.name
+
+        for histogram in ('Milestones', 'Components', 'Labels', 'Types'):
+            for key, count in other._project[histogram].items():
+                self._project[histogram][key] += count
+
+        resolvable = dict((account_id, self.users[account_id])
+                          for account_id in other._unresolved_users if account_id in self.users)
+        for issue in other.get_issues():
+            for comment in issue.comments:
+                for account_id, account_name in resolvable.items():
+                    comment.body = comment.body.replace(
+                        '/jira/people/' + account_id + '">Unknown user</a>',
+                        '/jira/people/' + account_id + '">' + account_name + '</a>')
+            self._index_issue(issue)
+        self._unresolved_users.update(other._unresolved_users.difference(resolvable))
+        self._attachments.update(other._attachments)
+
+        self.users.update(other.users)
+
+    def order_issues(self, fill_gaps=False, first_key=1):
+        """
+        Sorts the issues by the number of their key, so JIRA-n is imported n-th whatever the
+        order of the exports. With fill_gaps a closed placeholder issue is added for every key
+        missing from first_key up to the highest one, which keeps JIRA-n numbered GH-n in
+        a repository whose next issue number is first_key.
+        """
+        issues = self._project['Issues']
+        issues.sort(key=lambda issue: _key_number(issue.key))
+        self._reindex_issues()
+        if not fill_gaps or not issues:
+            return
+        filled = []
+        next_number = first_key
+        for issue in issues:
+            # placeholders before the first issue take its dates, the others those of the issue before them
+            neighbour = filled[-1] if filled else issue
+            for number in range(next_number, _key_number(issue.key)):
+                filled.append(self._gap_placeholder(number, neighbour))
+            filled.append(issue)
+            next_number = max(next_number, _key_number(issue.key) + 1)
+        if len(filled) > len(issues):
+            print('Added %d placeholder issues for keys missing from the exports' % (len(filled) - len(issues)))
+        issues[:] = filled
+        self._reindex_issues()
+
+    def _gap_placeholder(self, number, neighbour):
+        key = '%s-%d' % (self.name, number)
+        placeholder = Issue(key, key + ' was not exported',
+                            '<i>' + key + ' is missing from the JIRA export, this placeholder keeps '
+                            'the numbering of the imported issues.</i>',
+                            neighbour.created_at, neighbour.created_at, neighbour.created_at)
+        return placeholder
+
+    def _index_issue(self, issue):
+        """
+        Appends the issue unless it is already known from an overlapping export,
+        of two versions of an issue the one updated last is kept in the place of the first.
+        """
+        number = _key_number(issue.key)
+        issues = self._project['Issues']
+        position = self._issue_index.get(number)
+        if position is None:
+            self._issue_index[number] = len(issues)
+            issues.append(issue)
+            return
+        existing = issues[position]
+        if _moment(issue.updated_at) > _moment(existing.updated_at):
+            issues[position] = issue
+            self._forget_counts(existing)
+        else:
+            self._forget_counts(issue)
+        print('Skipping duplicate', issue.key, 'in favour of the version updated', issues[position].updated_at)
+
+    def _reindex_issues(self):
+        self._issue_index = dict((_key_number(issue.key), position)
+                                 for position, issue in enumerate(self._project['Issues']))
+
+    def _forget_counts(self, issue):
+        """
+        Takes a dropped duplicate out of the milestone and label histograms.
+        """
+        if issue.milestone_name is not None:
+            self._uncount('Milestones', issue.milestone_name)
+        for label in issue.labels:
+            for histogram in ('Components', 'Labels', 'Types'):
+                if self._project[histogram].get(label):
+                    self._uncount(histogram, label)
+                    break
+
+    def _uncount(self, histogram, key):
+        counts = self._project[histogram]
+        counts[key] -= 1
+        if counts[key] <= 0:
+            del counts[key]
+
+    def to_summary(self):
+        """
+        Returns everything of the project but its issues as plain JSON data.
+        """
+        return {'name': self.name, 'users': self.users,
+                'histograms': dict((histogram, dict(self._project[histogram]))
+                                   for histogram in ('Milestones', 'Components', 'Labels', 'Types'))}
+
+    @staticmethod
+    def from_summary(summary, default_labels=[]):
+        """
+        Creates a project without issues out of the data returned by to_summary.
+        """
+        project = Project(default_labels)
+        project.name = summary['name']
+        project.users.update(summary['users'])
+        for histogram, counts in summary['histograms'].items():
+            project._project[histogram].update(counts)
+        return project
+
     def prettify(self):
         def hist(h):
             for key in h.keys():
@@ -73,15 +255,7 @@ class Project:
         self.users[item.assignee.get('accountid')] = item.assignee.text
         self.users[item.reporter.get('accountid')] = item.reporter.text
 
-        original_body = self._htmlentitydecode(item.description.text)
-        resolved_body = self._resolve_urls(item.link.text, original_body)
-
-        self._capture_mentions(resolved_body)
-        try:
-            for comment in item.comments.comment:
-                self._capture_mentions(self._htmlentitydecode(comment.text))
-        except AttributeError:
-            pass
+        resolved_body = self._rewrite_body(item.link.text, item.description.text)
 
         body_text = (resolved_body +
                 '\n\n<i>Imported from <a href="' + item.link.text +
@@ -94,24 +268,18 @@ class Project:
                     self._people_link(item.link.text, item.assignee.get('accountid'), item.assignee.text) +
                     '</i>')
 
-        self._project['Issues'].append({'title': item.title.text[item.title.text.index("]") + 2:len(item.title.text)],
-                                        'key': item.key.text,
-                                        'body': body_text,
-                                        'created_at': self._convert_to_iso(item.created.text),
-                                        'updated_at': self._convert_to_iso(item.updated.text),
-                                        'labels': [],
-                                        'comments': [],
-                                        'duplicates': [],
-                                        'is-duplicated-by': [],
-                                        'is-related-to': [],
-                                        'depends-on': [],
-                                        'blocks': []
-                                        })
+        closed_at = None
         try:
-            self._project['Issues'][-1]['closed_at'] = self._convert_to_iso(item.resolved.text)
-            self._project['Issues'][-1]['closed'] = True
+            closed_at = self._convert_to_iso(item.resolved.text)
         except AttributeError:
-            self._project['Issues'][-1]['closed'] = False
+            pass
+
+        self._project['Issues'].append(Issue(item.key.text,
+                                             item.title.text[item.title.text.index("]") + 2:len(item.title.text)],
+                                             body_text,
+                                             self._convert_to_iso(item.created.text),
+                                             self._convert_to_iso(item.updated.text),
+                                             closed_at))
 
     def _people_link(self, base_url, account_id, account_name=None):
         if account_id is None:
@@ -123,128 +291,143 @@ class Project:
                 resolved_account_name = self.users[account_id]
             else:
                 resolved_account_name = 'Unknown user'
+                self._unresolved_users.add(account_id)
         return ('<a href="' +
                     urljoin(base_url, '/jira/people/' + account_id) +
                     '">' + resolved_account_name + '</a>')
 
-    def _resolve_urls(self, base_url, body_text):
-        #print('Raw body:', body_text)
-        updated_text = body_text
+    def _rewrite_body(self, base_url, body_text):
+        """
+        Rewrites a JIRA description or comment in one pass over the text:
+        HTML entities are decoded, images become links, link targets are made absolute
+        against the issue URL and mentioned users are remembered.
+        """
+        if body_text is None:
+            return ''
+
+        def rewrite_token(m):
+            if m['spaces']:
+                return ''
+            if m['entity']:
+                return _decode_entity(m)
+            if m['img'] is not None:
+                return self._image_link(base_url, m)
+            return self._anchor(base_url, m)
 
+        return _BODY_TOKEN.sub(rewrite_token, body_text)
+
+    def _image_link(self, base_url, m):
         # images aren't allowed on external server,
         # so until we can download them and attach them
         # switching them to links is the only way to include them
-        for m in re.finditer(r'<img [^>]*src="([^"]*)"[^>]*(alt="([^"]*)")?[^>]*>', updated_text):
-            url = m[1]
-            alt = m[3]
-            if not alt:
-                alt = os.path.basename(url)
-            updated_text = re.sub(m[0], '<a href="' + url + '">Image: ' + alt + '</a>', updated_text)
-
-        # can't fully parse these because they're not regular HTML
-        # so we'll just use regex to resolve the links
-        replacements = dict()
-        for m in re.finditer(r'<a [^>]*href="([^"]*)"[^>]*>', updated_text):
-            # it would be ideal to just download all of the attachments,
-            # but for now we'll just fix the URLs to point to the original source
-            replacements[m[1]] = urljoin(base_url, m[1])
-        #print('Replacement URLs:', repr(replacements))
-
-        for original in replacements:
-            updated_text = re.sub('"' + original + '"',
-                    '"' + replacements[original] + '"',
-                    updated_text)
-
-        #print('Resolved body:', updated_text)
-        return updated_text
+        attributes = _decode_text(m['img'])
+        src = _SRC_ATTRIBUTE.search(attributes)
+        if not src:
+            return '<img ' + attributes + '>'
+        alt = _ALT_ATTRIBUTE.search(attributes)
+        alt_text = alt[1] if alt and alt[1] else os.path.basename(urlsplit(src[1]).path)
+        url = urljoin(base_url, src[1])
+        self._note_attachment(base_url, url)
+        return '<a href="' + url + '">Image: ' + alt_text + '</a>'
+
+    def _anchor(self, base_url, m):
+        # it would be ideal to just download all of the attachments,
+        # but for now we'll just fix the URLs to point to the original source
+        attributes = _HREF_ATTRIBUTE.sub(
+            lambda href: 'href="' + self._link_target(base_url, href[1]) + '"', _decode_text(m['anchor']))
+        if m['anchor_text'] is None:
+            return '<a ' + attributes + '>'
+
+        anchor_text = _decode_text(m['anchor_text'])
+        mention = _ACCOUNTID_ATTRIBUTE.search(attributes)
+        if mention:
+            self.users[mention[1]] = anchor_text
+        return '<a ' + attributes + '>' + anchor_text + '</a>'
+
+    def _link_target(self, base_url, href):
+        url = urljoin(base_url, href)
+        if _ATTACHMENT_PATH.search(urlsplit(url).path):
+            self._note_attachment(base_url, url)
+        return url
+
+    def _note_attachment(self, base_url, url):
+        """
+        Records a URL for the attachment mirroring if it is on the JIRA server the issue was exported from,
+        images embedded from other hosts are left alone, they must not get the JIRA credentials.
+        """
+        if urlsplit(url).netloc == urlsplit(base_url).netloc:
+            self._attachments[url] = None
 
     def _convert_to_iso(self, timestamp):
-        dt = parse(timestamp)
-        return dt.isoformat()
+        return to_iso(timestamp)
 
     def _add_milestone(self, item):
         try:
             self._project['Milestones'][item.fixVersion.text] += 1
-            # this prop will be deleted later:
-            self._project['Issues'][-1]['milestone_name'] = item.fixVersion.text
+            self._project['Issues'][-1].milestone_name = item.fixVersion.text
         except AttributeError:
             pass
 
     def _add_labels(self, item):
         try:
             self._project['Components'][item.component.text.lower()] += 1
-            self._project['Issues'][-1]['labels'].append(item.component.text.lower())
+            self._project['Issues'][-1].add_label(item.component.text.lower())
         except AttributeError:
             pass
         
         try:
             for label in item.labels.label:
                 self._project['Labels'][label.text.lower()] += 1
-                self._project['Issues'][-1]['labels'].append(label.text.lower())
+                self._project['Issues'][-1].add_label(label.text.lower())
         except AttributeError:
             pass
 
         try:
             for label in self._default_labels:
                 self._project['Labels'][label.lower()] += 1
-                self._project['Issues'][-1]['labels'].append(label.lower())
+                self._project['Issues'][-1].add_label(label.lower())
         except AttributeError:
             pass
 
         try:
             self._project['Types'][item.type.text.lower()] += 1
-            self._project['Issues'][-1]['labels'].append(item.type.text.lower())
+            self._project['Issues'][-1].add_label(item.type.text.lower())
         except AttributeError:
             pass
 
     def _add_comments(self, item):
         try:
-            for comment in item.comments.comment:
-                comment_text = self._htmlentitydecode(comment.text)
-                resolved_text = self._resolve_urls(item.link.text, comment_text)
-
-                self._project['Issues'][-1]['comments'].append(
-                    {"created_at": self._convert_to_iso(comment.get('created')),
-                     "body": resolved_text + '\n<i>by ' +
-                     self._people_link(item.link.text, comment.get('author')) +
-                     '</i>'
-                     })
+            comments = list(item.comments.comment)
         except AttributeError:
-            pass
+            return
 
-    def _capture_mentions(self, comment_text):
-        for m in re.finditer(r'<a [^>]*accountid="([^"]*)"[^>]*>([^<]*)</a>', comment_text):
-            #print('Account matches:', m.groups())
-            self.users[m[1]] = m[2]
-        #print('All users:', self.users)
+        # users mentioned in any comment are known before the comment authors are linked
+        resolved_texts = [self._rewrite_body(item.link.text, comment.text) for comment in comments]
+        for comment, resolved_text in zip(comments, resolved_texts):
+            self._project['Issues'][-1].comments.append(
+                Comment(resolved_text + '\n<i>by ' +
+                        self._people_link(item.link.text, comment.get('author')) +
+                        '</i>',
+                        self._convert_to_iso(comment.get('created'))))
 
     def _add_relationships(self, item):
         try:
-            for issuelinktype in item.issuelinks.issuelinktype:
-                for outwardlink in issuelinktype.outwardlinks:
-                    for issuelink in outwardlink.issuelink:
-                        for issuekey in issuelink.issuekey:
-                            self._project['Issues'][-1][outwardlink.get(
-                                "description").replace(' ', '-')].append(issuekey.text)
+            issuelinktypes = list(item.issuelinks.issuelinktype)
         except AttributeError:
-            pass
-        except KeyError:
-            print('KeyError at ' + item.key.text)
+            return
+
+        for issuelinktype in issuelinktypes:
+            for links in self._children(issuelinktype, 'outwardlinks') + self._children(issuelinktype, 'inwardlinks'):
+                kind = links.get("description").replace(' ', '-')
+                if kind not in Link.KINDS:
+                    print('Unsupported link type ' + repr(kind) + ' at ' + item.key.text)
+                    continue
+                for issuelink in self._children(links, 'issuelink'):
+                    for issuekey in self._children(issuelink, 'issuekey'):
+                        self._project['Issues'][-1].add_link(kind, issuekey.text)
+
+    def _children(self, element, tag):
         try:
-            for issuelinktype in item.issuelinks.issuelinktype:
-                for inwardlink in issuelinktype.inwardlinks:
-                    for issuelink in inwardlink.issuelink:
-                        for issuekey in issuelink.issuekey:
-                            self._project['Issues'][-1][inwardlink.get(
-                                "description").replace(' ', '-')].append(issuekey.text)
+            return list(getattr(element, tag))
         except AttributeError:
-            pass
-        except KeyError:
-            print('KeyError at ' + item.key.text)
-
-    def _htmlentitydecode(self, s):
-        if s is None:
-            return ''
-        s = s.replace(' ' * 8, '')
-        return re.sub('&(%s);' % '|'.join(name2codepoint),
-                      lambda m: chr(name2codepoint[m.group(1)]), s)
+            return []
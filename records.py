@@ -0,0 +1,83 @@
+import sys
+
+
+class Link:
+    """
+    A relationship of an issue to another JIRA issue, e.g. 'blocks' PRO-12.
+    """
+    __slots__ = ('kind', 'key')
+
+    # the supported link descriptions, in the order they are turned into comments
+    KINDS = ('duplicates', 'is-duplicated-by', 'is-related-to', 'depends-on', 'blocks')
+
+    def __init__(self, kind, key):
+        self.kind = kind
+        self.key = key
+
+
+class Comment:
+    __slots__ = ('created_at', 'body')
+
+    def __init__(self, body, created_at=None):
+        self.body = body
+        self.created_at = created_at
+
+    def to_json(self):
+        """
+        Builds the comment as expected by the GitHub Issue Import API.
+        """
+        if self.created_at is None:
+            return {'body': self.body}
+        return {'created_at': self.created_at, 'body': self.body}
+
+
+class Issue:
+    """
+    A JIRA issue as it is going to be imported.
+    Relationships are kept in one list that is empty for most issues,
+    the JSON payload for GitHub is only built when the issue is uploaded.
+    """
+    __slots__ = ('key', 'title', 'body', 'created_at', 'updated_at', 'closed_at',
+                 'labels', 'comments', 'links', 'milestone_name', 'githubid')
+
+    def __init__(self, key, title, body, created_at, updated_at, closed_at=None):
+        self.key = key
+        self.title = title
+        self.body = body
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.closed_at = closed_at
+        self.labels = []
+        self.comments = []
+        self.links = ()
+        self.milestone_name = None
+        self.githubid = None
+
+    @property
+    def closed(self):
+        return self.closed_at is not None
+
+    def add_label(self, label):
+        # the same few label names are repeated on thousands of issues
+        self.labels.append(sys.intern(label))
+
+    def add_link(self, kind, key):
+        if not self.links:
+            self.links = []
+        self.links.append(Link(kind, key))
+
+    def to_json(self, milestone=None):
+        """
+        Builds the issue part of the GitHub Issue Import API payload.
+        """
+        data = {'title': self.title,
+                'body': self.body,
+                'created_at': self.created_at,
+                'updated_at': self.updated_at,
+                'labels': self.labels,
+                'closed': self.closed}
+        if self.closed_at is not None:
+            data['closed_at'] = self.closed_at
+        if milestone is not None:
+            data['milestone'] = milestone
+        return data
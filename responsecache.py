@@ -0,0 +1,96 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class ResponseCache:
+    """
+    Keeps the responses of GitHub GET requests that came with an ETag or Last-Modified header
+    in an SQLite file, so they can be revalidated with a conditional request: an unchanged
+    resource is answered with 304 Not Modified, which GitHub does not count against the rate limit.
+    Entries are keyed by the namespace (the API base URL), the URL and the parameters.
+    The least recently used entries are evicted once the bodies exceed max_bytes.
+    Safe to share between threads.
+    """
+    _DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+    def __init__(self, path, max_bytes=_DEFAULT_MAX_BYTES, namespace=''):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.namespace = namespace
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS responses ('
+                         'key TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, '
+                         'headers TEXT NOT NULL, body TEXT NOT NULL, size INTEGER NOT NULL, '
+                         'used_at REAL NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at)')
+        self._db.commit()
+        self._size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def key(self, url, params={}):
+        return json.dumps([self.namespace, url, sorted((k, str(v)) for k, v in params.items())])
+
+    def validators(self, key):
+        """
+        Returns the conditional request headers for a cached response, an empty dict if there is none.
+        """
+        with self._lock:
+            row = self._db.execute('SELECT etag, last_modified FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return dict()
+        headers = dict()
+        if row[0]:
+            headers['If-None-Match'] = row[0]
+        if row[1]:
+            headers['If-Modified-Since'] = row[1]
+        return headers
+
+    def get(self, key):
+        """
+        Returns the headers and the data of a cached response and marks it as used, None if it is gone.
+        """
+        with self._lock:
+            row = self._db.execute('SELECT headers, body FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute('UPDATE responses SET used_at = ? WHERE key = ?', (time.time(), key))
+            self._db.commit()
+        return json.loads(row[0]), json.loads(row[1])
+
+    def put(self, key, headers, data):
+        """
+        Stores a response if it carries a validator, otherwise drops what was stored for the key.
+        """
+        etag = headers.get('etag')
+        last_modified = headers.get('last-modified')
+        body = json.dumps(data)
+        with self._lock:
+            previous = self._db.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            if previous:
+                self._size -= previous[0]
+                self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+            if (etag or last_modified) and len(body) <= self.max_bytes:
+                self._db.execute('INSERT INTO responses (key, etag, last_modified, headers, body, size, used_at) '
+                                 'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                 (key, etag, last_modified, json.dumps(headers), body, len(body), time.time()))
+                self._size += len(body)
+                self._evict()
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _evict(self):
+        while self._size > self.max_bytes:
+            key, size = self._db.execute('SELECT key, size FROM responses ORDER BY used_at LIMIT 1').fetchone()
+            self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+            self._size -= size
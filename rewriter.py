@@ -0,0 +1,78 @@
+import re
+
+
+class Rewriter:
+    """
+    Rewrites text in a single pass with one compiled pattern combining several alternatives.
+    Each alternative is a regular expression with a callback returning the replacement.
+    The callback receives the match and the number of the first group of its own alternative,
+    the groups of an alternative are numbered from there on.
+    """
+
+    def __init__(self, alternatives):
+        self._callbacks = dict()
+        parts = []
+        group = 1
+        for regex, callback in alternatives:
+            group_count = re.compile(regex).groups
+            if not group_count and len(alternatives) > 1:
+                # an alternative needs a group of its own to be told apart from the others
+                regex = '(' + regex + ')'
+                group_count = 1
+            # wrapping every alternative in a group would defeat the literal prefix search
+            # of the regex engine, so any group of an alternative identifies it instead
+            for index in range(group, group + group_count):
+                self._callbacks[index] = (callback, group)
+            if not group_count:
+                self._callbacks[None] = (callback, group)
+            parts.append(regex)
+            group += group_count
+        self._pattern = re.compile('|'.join(parts)) if parts else None
+
+    def sub(self, text):
+        if self._pattern is None or not text:
+            return text
+        return self._pattern.sub(self._replace, text)
+
+    def _replace(self, match):
+        # the last group closed always belongs to the alternative that matched
+        callback, first = self._callbacks[match.lastindex]
+        return callback(match, first)
+
+
+class LiteralRewriter(Rewriter):
+    """
+    Replaces many literal strings in one pass.
+    The strings are compiled into a trie shaped pattern, so matching costs depend on
+    the length of the strings rather than their number, the longest string wins.
+    """
+
+    def __init__(self, replacements):
+        self._replacements = replacements
+        words = [word for word in replacements if word]
+        super().__init__([(_trie_pattern(words), self._lookup)] if words else [])
+
+    def _lookup(self, match, first):
+        return self._replacements[match[0]]
+
+
+def _trie_pattern(words):
+    trie = dict()
+    for word in words:
+        node = trie
+        for character in word:
+            node = node.setdefault(character, dict())
+        node[''] = None
+    return _node_pattern(trie)
+
+
+def _node_pattern(node):
+    branches = [re.escape(character) + _node_pattern(child)
+                for character, child in sorted(node.items(), key=lambda i: i[0]) if character]
+    if not branches:
+        return ''
+    if len(branches) == 1 and '' not in node:
+        return branches[0]
+    pattern = '(?:' + '|'.join(branches) + ')'
+    # a word ending here is optional, so longer words are tried first
+    return pattern + '?' if '' in node else pattern
@@ -0,0 +1,263 @@
+from email.utils import parsedate_to_datetime
+from transport import ApiError, Response
+import random
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Hands out tokens at a steady rate with bursts of up to capacity tokens.
+    Not thread-safe on its own, the RequestScheduler guards it.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+
+    def delay(self, reserve=0.0):
+        """
+        Returns the seconds until a token is available without dipping below the reserve.
+        """
+        self._refill()
+        missing = 1.0 + reserve - self.tokens
+        return max(missing, 0.0) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1.0
+
+    def retune(self, rate, capacity):
+        self._refill()
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = min(self.tokens, capacity)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+class RequestScheduler:
+    """
+    Sends all requests of the Importer through the transport while staying under GitHub's rate limits.
+    The request rate follows the X-RateLimit-* headers of the responses so the remaining budget
+    is spread until the window resets, separately for each rate limit resource like core and graphql, content-creating requests can be capped per minute like
+    GitHub's secondary limits ask for. Rate-limited requests wait for Retry-After or the reset,
+    failed idempotent requests are retried with exponential backoff and jitter, other requests
+    only when the caller can tell whether the server processed them.
+    LOW priority requests, like import status polls, wait while HIGH priority ones are queued
+    and leave a reserve of the budget to them.
+    With a ResponseCache, GET requests are sent conditionally and 304 responses are answered
+    from the cached copy.
+    """
+    HIGH = 0
+    LOW = 1
+    _RETRYABLE_STATUSES = (500, 502, 503, 504)
+    _IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'PATCH', 'DELETE')
+    _WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+    _DEFAULT_WRITES_PER_MINUTE = 80
+    _SECONDARY_LIMIT_DELAY = 60.0
+    _SAFETY = 0.9
+    _LOW_PRIORITY_RESERVE = 0.2
+
+    def __init__(self, transport, metrics=None, writes_per_minute=None, max_retries=6,
+                 base_delay=1.0, max_delay=120.0, burst=20, cache=None):
+        self.transport = transport
+        self.metrics = metrics
+        self.cache = cache
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.burst = burst
+        self._condition = threading.Condition()
+        self._waiting_high = 0
+        # by rate limit resource, None blocks every request
+        self._blocked_until = dict()
+        # by rate limit resource, unlimited until the first response tells the actual budget
+        self._requests = dict()
+        self._writes = None
+        if writes_per_minute:
+            self._writes = TokenBucket(writes_per_minute / 60.0, min(burst, writes_per_minute))
+        self._random = random.Random()
+
+    def request(self, method, url, payload=None, params={}, priority=HIGH, headers={}, recover=None):
+        """
+        Sends a request once the rate limits allow it and retries it while the failure is transient.
+        Extra headers are sent along with the cache validators. A request that is not idempotent
+        is only retried with a recover function: it is called with the ApiError and returns
+        the response if the server processed the request after all, None to send it again.
+        Returns the transport's response or raises the last ApiError.
+        """
+        cache_key = self.cache.key(url, params) if self.cache and method == 'GET' else None
+        conditional = self.cache.validators(cache_key) if cache_key else {}
+        resource = self._resource(url)
+        attempt = 0
+        while True:
+            self._acquire(method, priority, resource)
+            started = time.monotonic()
+            try:
+                response = self.transport.request(method, url, payload, params, dict(headers, **conditional))
+            except ApiError as e:
+                if e.status == 304 and conditional:
+                    # `gh api` fails on a 304
+                    response = Response(304, e.headers, None)
+                else:
+                    self._record(method, url, started, e.status or 'error')
+                    self._observe_headers(e.headers, resource)
+                    if recover and method not in self._IDEMPOTENT_METHODS and (
+                            e.status is None or e.status in self._RETRYABLE_STATUSES):
+                        recovered = recover(e)
+                        if recovered is not None:
+                            return recovered
+                    delay = self._retry_delay(method, e, attempt, resource, recover is not None)
+                    if delay is None:
+                        raise
+                    attempt += 1
+                    if self.metrics:
+                        self.metrics.record_retry(method, url, e.status or 'error')
+                    print('Retrying %s %s in %.1f s after %s (attempt %d of %d)' % (
+                        method, url, delay, e.status or 'a failed request', attempt, self.max_retries))
+                    time.sleep(delay)
+                    continue
+            self._record(method, url, started, response.status)
+            self._observe_headers(response.headers, resource)
+            if cache_key is None:
+                return response
+            if response.status == 304:
+                cached = self.cache.get(cache_key)
+                if cached is None:
+                    # evicted since the request was sent
+                    conditional = {}
+                    continue
+                self._count('http_cache_hits')
+                return Response(200, cached[0], cached[1])
+            self._count('http_cache_misses')
+            self.cache.put(cache_key, response.headers, response.data)
+            return response
+
+    def _resource(self, url):
+        """
+        Returns the rate limit resource a request counts against, GraphQL has a budget of its own.
+        """
+        return 'graphql' if url.partition('?')[0].rstrip('/').endswith('/graphql') else 'core'
+
+    def _acquire(self, method, priority, resource):
+        with self._condition:
+            if priority == self.HIGH:
+                self._waiting_high += 1
+            try:
+                while True:
+                    if priority == self.LOW and self._waiting_high:
+                        self._condition.wait(1.0)
+                        continue
+                    delay = max(self._blocked_until.get(None, 0.0),
+                                self._blocked_until.get(resource, 0.0)) - time.monotonic()
+                    for bucket in self._buckets(method, resource):
+                        reserve = bucket.capacity * self._LOW_PRIORITY_RESERVE if priority == self.LOW else 0.0
+                        delay = max(delay, bucket.delay(reserve))
+                    if delay <= 0:
+                        for bucket in self._buckets(method, resource):
+                            bucket.take()
+                        return
+                    self._condition.wait(delay)
+            finally:
+                if priority == self.HIGH:
+                    self._waiting_high -= 1
+                self._condition.notify_all()
+
+    def _buckets(self, method, resource):
+        buckets = [self._requests.get(resource)]
+        if method in self._WRITE_METHODS:
+            buckets.append(self._writes)
+        return [bucket for bucket in buckets if bucket]
+
+    def _observe_headers(self, headers, resource):
+        """
+        Spreads the remaining primary rate limit budget of the resource evenly until the window resets.
+        """
+        resource = headers.get('x-ratelimit-resource') or resource
+        remaining = headers.get('x-ratelimit-remaining')
+        reset = headers.get('x-ratelimit-reset')
+        if remaining is None or reset is None:
+            return
+        try:
+            remaining = int(remaining)
+            window = float(reset) - time.time()
+        except ValueError:
+            return
+        with self._condition:
+            if remaining <= 0:
+                self._block(window + 1.0, resource)
+                return
+            budget = remaining * self._SAFETY
+            rate = budget / max(window, 1.0)
+            capacity = max(1.0, min(self.burst, budget))
+            if resource not in self._requests:
+                self._requests[resource] = TokenBucket(rate, capacity)
+            else:
+                self._requests[resource].retune(rate, capacity)
+
+    def _retry_delay(self, method, error, attempt, resource, recoverable=False):
+        """
+        Returns how long to wait before retrying a failed request, None if it must not be retried.
+        """
+        if attempt >= self.max_retries:
+            return None
+        status = error.status
+        headers = error.headers
+        if status in (403, 429):
+            # secondary limits and Retry-After hold back everyone, an exhausted primary limit only its resource
+            blocked = None
+            retry_after = self._retry_after(headers)
+            if retry_after is None and headers.get('x-ratelimit-remaining') == '0':
+                retry_after = float(headers.get('x-ratelimit-reset', 0)) - time.time() + 1.0
+                blocked = headers.get('x-ratelimit-resource') or resource
+            if retry_after is None and (status == 429 or 'secondary rate limit' in str(error).lower()):
+                retry_after = max(self._SECONDARY_LIMIT_DELAY, self._backoff(attempt))
+            if retry_after is None:
+                # a plain 403 means missing permissions
+                return None
+            # rate limited requests were not processed, so every method can be retried,
+            # and everyone else waits as well
+            with self._condition:
+                self._block(retry_after, blocked)
+            return max(retry_after, 0.0)
+        # a POST that failed on the server may still have been processed, resending it could duplicate it
+        if method not in self._IDEMPOTENT_METHODS and not recoverable:
+            return None
+        if status is None or status in self._RETRYABLE_STATUSES:
+            return self._backoff(attempt)
+        return None
+
+    def _retry_after(self, headers):
+        value = headers.get('retry-after')
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        try:
+            return parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+
+    def _backoff(self, attempt):
+        # full jitter, so retrying threads do not hit the server in lockstep
+        return self._random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _block(self, seconds, resource=None):
+        self._blocked_until[resource] = max(self._blocked_until.get(resource, 0.0), time.monotonic() + seconds)
+        self._condition.notify_all()
+
+    def _count(self, name):
+        if self.metrics:
+            self.metrics.count(name)
+
+    def _record(self, method, url, started, status):
+        if self.metrics:
+            self.metrics.record_call(method, url, time.monotonic() - started, status)
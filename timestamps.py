@@ -0,0 +1,33 @@
+from datetime import datetime, timedelta, timezone
+from dateutil.parser import parse
+from functools import lru_cache
+import re
+
+# the format JIRA uses in its XML exports, e.g. 'Tue, 3 Mar 2020 10:12:01 +0000'
+_JIRA_TIMESTAMP = re.compile(r'(?:[A-Za-z]{3}, )?(\d{1,2}) ([A-Za-z]{3}) (\d{4}) '
+                             r'(\d{2}):(\d{2}):(\d{2}) ([+-])(\d{2})(\d{2})$')
+_MONTHS = dict((name, number) for number, name in
+               enumerate(('jan', 'feb', 'mar', 'apr', 'may', 'jun',
+                          'jul', 'aug', 'sep', 'oct', 'nov', 'dec'), 1))
+
+
+def to_iso(timestamp):
+    """
+    Converts a JIRA timestamp to ISO 8601.
+    The fixed JIRA export format is parsed directly, anything else is left to dateutil.
+    """
+    m = _JIRA_TIMESTAMP.match(timestamp)
+    month = _MONTHS.get(m[2].lower()) if m else None
+    if month is None:
+        return parse(timestamp).isoformat()
+    try:
+        return datetime(int(m[3]), month, int(m[1]), int(m[4]), int(m[5]), int(m[6]),
+                        tzinfo=_timezone(m[7], m[8], m[9])).isoformat()
+    except ValueError:
+        return parse(timestamp).isoformat()
+
+
+@lru_cache(maxsize=64)
+def _timezone(sign, hours, minutes):
+    offset = timedelta(hours=int(hours), minutes=int(minutes))
+    return timezone(-offset if sign == '-' else offset)
@@ -0,0 +1,203 @@
+from collections import namedtuple
+from urllib.parse import urlencode, urlsplit
+import http.client
+import json
+import os
+import queue
+import re
+import select
+import subprocess
+
+Response = namedtuple("Response", "status headers data")
+
+_NEXT_PAGE_LINK = re.compile(r'<([^>]*)>;\s*rel="next"')
+
+
+class ApiError(RuntimeError):
+    """
+    Raised when a GitHub API call fails. Keeps the HTTP status and response headers
+    where the transport knows them, status is None when the request never got an answer.
+    """
+
+    def __init__(self, message, status=None, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or dict()
+
+
+def _relative(url):
+    """
+    Strips scheme and host from an absolute URL, e.g. one taken from a Link header.
+    """
+    if '://' not in url:
+        return url
+    parts = urlsplit(url)
+    return parts.path + ('?' + parts.query if parts.query else '')
+
+
+def next_page_url(headers):
+    """
+    Returns the URL of the next page of a paginated listing, None on the last page.
+    """
+    match = _NEXT_PAGE_LINK.search(headers.get('link', ''))
+    return match[1] if match else None
+
+
+def _decode_body(body):
+    if not body or not body.strip():
+        return None
+    return json.loads(body)
+
+
+class GhCliTransport:
+    """
+    Sends every request through a `gh api` subprocess.
+    Slow, but needs nothing besides an authenticated `gh` installation.
+    """
+
+    def request(self, method, path, payload=None, params={}, headers={}):
+        command = ['gh', 'api', '--include', '-X', method, _relative(path), ]
+        for pk in params:
+            command.append('-f')
+            command.append(pk + '=' + str(params[pk]))
+        for hk in headers:
+            command.append('-H')
+            command.append(hk + ': ' + headers[hk])
+        if payload is not None:
+            command.append('--input')
+            command.append('-')
+            bytes_in = json.dumps(payload).encode()
+        else:
+            bytes_in = None
+        result = subprocess.run(command, capture_output=True, input=bytes_in)
+        status, response_headers, body = self._split_response(result.stdout)
+        if result.returncode:
+            raise ApiError('Failure return code ' +
+                           repr(result.returncode) +
+                           ' from command:\n' + repr(result.stdout) +
+                           '\n' + repr(result.stderr),
+                           status, response_headers)
+        return Response(status, response_headers, _decode_body(body))
+
+    def _split_response(self, output):
+        """
+        Splits the `--include` output of `gh api` into status, headers and body.
+        """
+        text = output.decode(errors='replace')
+        if not text.startswith('HTTP/'):
+            return None, dict(), text
+        head, _, body = text.replace('\r\n', '\n').partition('\n\n')
+        lines = head.split('\n')
+        status = int(lines[0].split()[1])
+        headers = dict()
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return status, headers, body
+
+
+class HttpTransport:
+    """
+    Talks to the GitHub REST API in-process over a small pool of keep-alive connections,
+    so consecutive calls reuse the same TLS session instead of spawning `gh` each time.
+    The pool is safe to share between threads.
+    """
+    _DEFAULT_BASE_URL = 'https://api.github.com'
+    _DEFAULT_TIME_OUT = 120.0
+    # the methods that may be sent again when it is unknown whether the server got them
+    _IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'PATCH', 'DELETE')
+
+    def __init__(self, token, base_url=_DEFAULT_BASE_URL, pool_size=8, timeout=_DEFAULT_TIME_OUT):
+        url = urlsplit(base_url)
+        self._scheme = url.scheme
+        self._netloc = url.netloc
+        self._prefix = url.path.rstrip('/')
+        self._timeout = timeout
+        self._pool = queue.LifoQueue()
+        for _ in range(pool_size):
+            self._pool.put(None)
+        self._headers = {'Accept': 'application/vnd.github+json',
+                         'User-Agent': 'jira-issues-importer',
+                         'X-GitHub-Api-Version': '2022-11-28'}
+        if token:
+            self._headers['Authorization'] = 'Bearer ' + token
+
+    @staticmethod
+    def from_gh(base_url=None):
+        """
+        Creates a transport authenticated with the token of the `gh` CLI
+        (GH_TOKEN / GITHUB_TOKEN take precedence, like they do for `gh` itself).
+        """
+        token = os.environ.get('GH_TOKEN') or os.environ.get('GITHUB_TOKEN')
+        if not token:
+            result = subprocess.run(['gh', 'auth', 'token'], capture_output=True)
+            if result.returncode:
+                raise ApiError('Unable to read the gh token:\n' + repr(result.stderr))
+            token = result.stdout.decode().strip()
+        return HttpTransport(token, base_url or HttpTransport._DEFAULT_BASE_URL)
+
+    def request(self, method, path, payload=None, params={}, headers={}):
+        # absolute URLs, like the ones in Link headers, already carry the prefix
+        target = _relative(path) if '://' in path else self._prefix + path
+        body = None
+        if method == 'GET':
+            if params:
+                target += ('&' if '?' in target else '?') + urlencode(params)
+        elif payload is not None or params:
+            body = json.dumps(payload if payload is not None else params).encode()
+
+        request_headers = dict(self._headers)
+        request_headers.update(headers)
+        if body is not None:
+            request_headers['Content-Type'] = 'application/json'
+
+        status, response_headers, data = self._send(method, target, body, request_headers)
+        if status >= 400:
+            raise ApiError('Failure status ' + repr(status) + ' from ' + method + ' ' + path +
+                           ':\n' + repr(data), status, response_headers)
+        return Response(status, response_headers, _decode_body(data.decode(errors='replace')))
+
+    def _send(self, method, target, body, headers):
+        connection = self._pool.get()
+        if connection is not None and self._dropped(connection):
+            connection.close()
+            connection = None
+        reused = connection is not None
+        try:
+            while True:
+                if connection is None:
+                    connection = self._connect()
+                sent = False
+                try:
+                    connection.request(method, target, body=body, headers=headers)
+                    sent = True
+                    response = connection.getresponse()
+                    data = response.read()
+                    response_headers = dict((k.lower(), v) for k, v in response.getheaders())
+                    if response.will_close:
+                        connection.close()
+                        connection = None
+                    return response.status, response_headers, data
+                except (http.client.HTTPException, OSError) as e:
+                    connection.close()
+                    connection = None
+                    # the server may have dropped an idle pooled connection, that case is retried
+                    # once on a fresh connection, unless a request that is not idempotent was sent
+                    # completely: the server may have processed it before the connection broke
+                    if (not reused or not isinstance(e, (http.client.HTTPException, ConnectionError)) or
+                            sent and method not in HttpTransport._IDEMPOTENT_METHODS):
+                        raise ApiError('Request ' + method + ' ' + target + ' failed: ' + repr(e))
+                    reused = False
+        finally:
+            self._pool.put(connection)
+
+    def _dropped(self, connection):
+        """
+        Tells whether the server closed an idle pooled connection, its socket reads as ready then.
+        """
+        return connection.sock is None or bool(select.select([connection.sock], [], [], 0)[0])
+
+    def _connect(self):
+        if self._scheme == 'http':
+            return http.client.HTTPConnection(self._netloc, timeout=self._timeout)
+        return http.client.HTTPSConnection(self._netloc, timeout=self._timeout)
@@ -0,0 +1,73 @@
+from concurrent.futures import ProcessPoolExecutor
+from lxml import etree, objectify
+from project import Project
+import os
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+def iter_items(file_name):
+    """
+    Streams the <item> elements of a JIRA XML export one at a time.
+    The file is fed to an incremental parser as raw bytes and each item is
+    cleared and detached from the tree once the caller has processed it,
+    so memory use stays flat regardless of the size of the export.
+    """
+    parser = etree.XMLPullParser(events=('end',), tag='item',
+                                 remove_blank_text=True, huge_tree=True)
+    # objectify lookup keeps the attribute style access Project relies on
+    parser.set_element_class_lookup(objectify.ObjectifyElementClassLookup())
+
+    with open(file_name, 'rb') as source:
+        for chunk in iter(lambda: source.read(_CHUNK_SIZE), b''):
+            parser.feed(chunk)
+            yield from _read_items(parser)
+    parser.close()
+    yield from _read_items(parser)
+
+
+def _read_items(parser):
+    for _, item in parser.read_events():
+        parent = item.getparent()
+        if parent is None or parent.tag != 'channel':
+            continue
+        yield item
+        item.clear()
+        parent.remove(item)
+
+
+def parse_file(file_name, default_labels=[]):
+    """
+    Builds a partial project out of a single JIRA XML export.
+    """
+    project = Project(default_labels)
+    for item in iter_items(file_name):
+        project.add_item(item)
+    return project
+
+
+def parse_files(file_names, default_labels=[], workers=None):
+    """
+    Parses the given JIRA XML exports into one project.
+    Each file is parsed and transformed into a partial project in its own worker process,
+    the partial projects are then merged in command line order.
+    Issues exported more than once are kept once and the issues are sorted by key number.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(file_names))
+
+    project = Project(default_labels)
+    if workers <= 1:
+        for file_name in file_names:
+            for item in iter_items(file_name):
+                project.add_item(item)
+        project.order_issues()
+        return project
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for partial_project in executor.map(parse_file, file_names,
+                                            [default_labels] * len(file_names)):
+            project.merge(partial_project)
+    project.order_issues()
+    return project